@@ -1,6 +1,9 @@
 import streamlit as st
-from Database import get_students, delete_student, add_student, create_connection
-import pandas as pd
+from Database import count_students, count_search_results, get_students_page, search_students, get_student, STUDENT_COLUMNS
+import io
+from Engine import import_students, export_students, apply_student_edits, add_student, update_student, delete_student, asks_campus, shard_names, on_shard
+from Metrics import snapshot, timed
+from Settings import get_settings, save_settings
 
 def admin_login():
     admin_user = st.text_input("Admin Username", key="admin_user")
@@ -15,42 +18,62 @@ def admin_login():
         else:
             st.error("Invalid Admin Username or Password.")
 
+@timed('render_manage_students')
 def manage_students():
+    shards = shard_names()
+    if shards is None:
+        student_pages(sharded=False)
+    elif shards:
+        # Sharded storage: one shard's students at a time, and writes go
+        # through the shard directory so the students can still log in.
+        shard = st.selectbox("Shard", shards)
+        with on_shard(shard):
+            student_pages(sharded=True)
+    else:
+        st.info("No students have registered yet.")
+        add_student_form()
+    show_diagnostics()
+
+def student_pages(sharded):
+    # pandas is only imported once an admin is in
+    import pandas as pd
     st.subheader("Student Database")
-    students = get_students()
-    st.dataframe(students)
+    col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
+    search = col1.text_input("Search students")
+    sort_by = col2.selectbox("Sort by", STUDENT_COLUMNS)
+    page_size = col3.selectbox("Rows per page", [25, 50, 100])
+    descending = col4.checkbox("Descending")
+    ranked = col5.checkbox("Rank by relevance", help="Match whole words and prefixes in name, department and interests, best matches first")
+
+    ranked = ranked and bool(search)
+    total = count_search_results(search) if ranked else count_students(search)
+    pages = max(1, -(-total // page_size))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1)
+    if ranked:
+        students = search_students(search, page - 1, page_size)
+    else:
+        students = get_students_page(page - 1, page_size, sort_by, descending, search)
+    if st.checkbox("Edit in grid", disabled=sharded,
+                   help="Not available with sharded storage" if sharded else "Change cells, add rows at the bottom or delete rows, then save them all at once"):
+        edit_grid(students, (page, page_size, sort_by, descending, search, ranked))
+    else:
+        st.dataframe(students, hide_index=True)
+    st.caption(f"{total} students, page {page} of {pages}")
 
     # Create tabs for Add, Edit, and Delete student operations
-    tab1, tab2, tab3 = st.tabs(["Add Student", "Edit Student", "Delete Student"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Add Student", "Edit Student", "Delete Student", "Import / Export", "Matching"])
 
     # Add Student Tab
     with tab1:
-        st.subheader("Add New Student")
-        name = st.text_input("Name (Add)")
-        department = st.text_input("Department (Add)")
-        year = st.number_input("Year (Add)", min_value=1, max_value=4)
-        interests = st.text_input("Interests (Add)")
-        linkedin_id = st.text_input("LinkedIn ID (Add)")
-        phone_number = st.text_input("Phone Number (Add)")
-        email = st.text_input("Email (Add)")
-        user_id = st.text_input("User ID (Add)")
-        password = st.text_input("Password (Add)", type='password')
-
-        if st.button("Add Student"):
-            if add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password):
-                st.success("Student added successfully!")
-            else:
-                st.error("Email or User ID already exists!")
+        add_student_form()
 
     # Edit Student Tab
     with tab2:
         st.subheader("Edit Existing Student")
         student_id = st.number_input("Student ID to edit", min_value=1, step=1)
         if student_id:
-            students = get_students()
-            student = students[students['id'] == student_id]
-            if not student.empty:
-                student = student.iloc[0]
+            student = get_student(student_id)
+            if student is not None:
                 name = st.text_input("Name (Edit)", value=student['name'])
                 department = st.text_input("Department (Edit)", value=student['department'])
                 year = st.number_input("Year (Edit)", min_value=1, max_value=4, value=student['year'])
@@ -59,30 +82,114 @@ def manage_students():
                 phone_number = st.text_input("Phone Number (Edit)", value=student['phone_number'])
                 email = st.text_input("Email (Edit)", value=student['email'])
                 user_id = st.text_input("User ID (Edit)", value=student['user_id'])
-                password = st.text_input("Password (Edit)", value=student['password'], type='password')
+                password = st.text_input("New Password (Edit)", type='password', help="Leave blank to keep the current password")
 
                 if st.button("Update Student"):
-                    # Check if email or user_id already exists
-                    if email != student['email'] or user_id != student['user_id']:
-                        if not add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password):
-                            st.error("Update failed: Email or User ID already exists.")
-                        else:
-                            st.success("Student updated successfully!")
+                    if update_student(student['user_id'], name, department, year, interests, linkedin_id, phone_number,
+                                      password, email, user_id):
+                        st.success("Student updated successfully!")
                     else:
-                        with create_connection() as conn:
-                            conn.execute('''
-                                UPDATE students
-                                SET name = ?, department = ?, year = ?, interests = ?, linkedin_id = ?, phone_number = ?, password = ?
-                                WHERE id = ?
-                            ''', (name, department, year, interests, linkedin_id, phone_number, password, student_id))
-                            st.success("Student updated successfully!")
+                        st.error("Update failed: Email or User ID already exists.")
 
     # Delete Student Tab
     with tab3:
         st.subheader("Delete Student")
         student_id = st.number_input("Student ID to delete", min_value=1, step=1)
         if st.button("Delete Student"):
-            if delete_student(student_id):
+            student = get_student(student_id)
+            if student is not None and delete_student(student['user_id']):
                 st.success("Student deleted successfully!")
             else:
                 st.error("Error deleting student. Please check the ID.")
+
+    # Bulk Import / Export Tab
+    with tab4:
+        st.subheader("Import Students")
+        if sharded:
+            st.info("Importing isn't available with sharded storage; add students one at a time instead.")
+        upload = None if sharded else st.file_uploader("CSV or Parquet file", type=["csv", "parquet"])
+        if upload is not None and st.button("Import Students"):
+            result = import_students(upload, 'parquet' if upload.name.lower().endswith('.parquet') else 'csv')
+            st.success(f"Imported {result['inserted']} students.")
+            if result['conflicts']:
+                st.warning(f"{len(result['conflicts'])} rows were rejected.")
+                st.dataframe(pd.DataFrame(result['conflicts'], columns=["Row", "Problem"]), hide_index=True)
+
+        st.subheader("Export Students")
+        if st.button("Prepare CSV Export"):
+            buffer = io.StringIO()
+            export_students(buffer, 'csv')
+            st.session_state['student_export'] = buffer.getvalue()
+        if 'student_export' in st.session_state:
+            st.download_button("Download students.csv", st.session_state['student_export'], file_name="students.csv", mime="text/csv")
+
+    # Matching Settings Tab
+    with tab5:
+        st.subheader("Matching Settings")
+        settings = get_settings()
+        match_count = st.number_input("Matches per student", min_value=1, max_value=50, value=settings['match_count'])
+        interest_weight = st.slider("Shared interests weight", 0.0, 1.0, settings['interest_weight'], 0.05)
+        department_weight = st.slider("Same department weight", 0.0, 1.0, settings['department_weight'], 0.05)
+        year_weight = st.slider("Close year of study weight", 0.0, 1.0, settings['year_weight'], 0.05)
+        st.caption("Students still need at least one interest in common to be matched; department and year only change the order.")
+        if st.button("Save Matching Settings"):
+            save_settings({'match_count': match_count, 'interest_weight': interest_weight,
+                           'department_weight': department_weight, 'year_weight': year_weight})
+            st.success("Matching settings saved!")
+
+def add_student_form():
+    st.subheader("Add New Student")
+    name = st.text_input("Name (Add)")
+    department = st.text_input("Department (Add)")
+    year = st.number_input("Year (Add)", min_value=1, max_value=4)
+    interests = st.text_input("Interests (Add)")
+    linkedin_id = st.text_input("LinkedIn ID (Add)")
+    phone_number = st.text_input("Phone Number (Add)")
+    email = st.text_input("Email (Add)")
+    user_id = st.text_input("User ID (Add)")
+    password = st.text_input("Password (Add)", type='password')
+    campus = st.text_input("Campus (Add)") if asks_campus() else None
+
+    if st.button("Add Student"):
+        try:
+            added = add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password,
+                                campus)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        if added:
+            st.success("Student added successfully!")
+        else:
+            st.error("Email or User ID already exists!")
+
+def edit_grid(students, view):
+    import pandas as pd
+    # A new key after each save (or page change) starts the editor afresh
+    # from the reloaded rows.
+    version = st.session_state.setdefault('grid_version', 0)
+    original = students.assign(password='')
+    edited = st.data_editor(original, hide_index=True, num_rows='dynamic', disabled=['id'],
+                            column_config={'password': st.column_config.TextColumn(
+                                "password", help="Required for new rows; leave blank to keep the current one")},
+                            key=f'student_grid_{version}_{view}')
+    if st.button("Save Grid Changes"):
+        result = apply_student_edits(original.to_dict('records'), edited.to_dict('records'))
+        if result['conflicts']:
+            st.error("Nothing was saved; fix these rows and try again.")
+            st.dataframe(pd.DataFrame(result['conflicts'], columns=["Row", "Problem"]), hide_index=True)
+        else:
+            st.session_state['grid_version'] = version + 1
+            st.success(f"Saved {result['inserted']} new, {result['updated']} updated and {result['deleted']} deleted students.")
+
+def show_diagnostics():
+    import pandas as pd
+    with st.expander("Diagnostics"):
+        metrics = snapshot()
+        st.caption(f"Process {metrics['pid']}")
+        if metrics['timings']:
+            st.dataframe(pd.DataFrame.from_dict(metrics['timings'], orient='index'))
+        if metrics['caches']:
+            st.dataframe(pd.DataFrame.from_dict(metrics['caches'], orient='index'))
+        counters = {**metrics['counters'], **metrics['gauges']}
+        if counters:
+            st.dataframe(pd.DataFrame.from_dict(counters, orient='index', columns=['value']))
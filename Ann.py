@@ -0,0 +1,287 @@
+import argparse
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+import Connection
+from Metrics import timer
+from Recommender import get_index, score_candidates, top_k, top_matches
+
+BACKEND = os.environ.get('MATCH_BACKEND', 'exact')
+BACKEND_OPTIONS = {}
+
+_lock = threading.Lock()
+# Database path -> backend built over its index.
+_backends = {}
+
+
+def _inverted_lists(labels, size):
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(size + 1))
+    return [np.sort(order[bounds[i]:bounds[i + 1]]) for i in range(size)]
+
+
+class ExactSearch:
+    def __init__(self, index):
+        self.index = index
+
+    def refreshed(self, index):
+        return ExactSearch(index)
+
+    def candidates(self, row):
+        # Every row; callers score the whole roster through the postings.
+        return None
+
+    def top_matches(self, row, k):
+        return top_matches(self.index, row, k)
+
+
+class _IncrementalSearch:
+    # What an approximate backend derives per row (hash keys, list
+    # assignments) is kept when the index changes: rows of students whose
+    # interests are unchanged carry theirs over and only new or edited rows
+    # are placed, instead of rebuilding. Terms get ids of their own since
+    # column order can differ between indexes (Streaming.build_store);
+    # rows are fingerprinted by their counts against a random value per term.
+    def _start(self, index, seed):
+        self.index = index
+        self.rng = np.random.default_rng(seed)
+        self.terms = {}
+        self.term_values = np.zeros(0)
+        columns = self._term_columns(index)
+        self.fingerprints = index.counts @ self.term_values[columns]
+        return columns
+
+    def _term_columns(self, index):
+        # The term id of each of index's columns; unseen terms get new ids in
+        # column order, so on the first index ids and columns coincide.
+        missing = sorted((column, term) for term, column in index.vocabulary.items() if term not in self.terms)
+        if missing:
+            self.terms = {**self.terms, **{term: len(self.terms) + i for i, (_, term) in enumerate(missing)}}
+            self.term_values = np.concatenate([self.term_values, self.rng.random(len(missing))])
+            self._add_terms(len(missing))
+        columns = np.empty(len(index.vocabulary), dtype=np.intp)
+        columns[np.fromiter(index.vocabulary.values(), dtype=np.intp, count=len(columns))] = \
+            np.fromiter(map(self.terms.get, index.vocabulary), dtype=np.intp, count=len(columns))
+        return columns
+
+    def _add_terms(self, count):
+        pass
+
+    def _carry(self, index, fingerprints):
+        # Each of index's rows' row in self.index when the student is there
+        # with the same interests, else -1.
+        old_ids = np.asarray(self.index.ids, dtype=np.int64)
+        new_ids = np.asarray(index.ids, dtype=np.int64)
+        if not len(old_ids):
+            return np.full(len(new_ids), -1, dtype=np.intp)
+        order = np.argsort(old_ids, kind='stable')
+        rows = order[np.searchsorted(old_ids[order], new_ids).clip(max=len(old_ids) - 1)]
+        same = (old_ids[rows] == new_ids) & np.isclose(self.fingerprints[rows], fingerprints, rtol=0, atol=1e-9)
+        return np.where(same, rows, -1)
+
+    def refreshed(self, index):
+        # A new backend for index; this one is left intact for searches that
+        # are still using it.
+        backend = copy.copy(self)
+        columns = backend._term_columns(index)
+        fingerprints = index.counts @ backend.term_values[columns]
+        rows = self._carry(index, fingerprints)
+        fresh = np.flatnonzero(rows < 0)
+        matrix = index.tfidf_matrix()[fresh]
+        # The fresh rows with their columns renumbered by term id.
+        matrix = sparse.csr_matrix((matrix.data, columns[matrix.indices], matrix.indptr),
+                                   shape=(len(fresh), len(backend.terms)))
+        backend.index, backend.fingerprints = index, fingerprints
+        backend._place(rows, fresh, matrix)
+        return backend
+
+
+class LSHSearch(_IncrementalSearch):
+    # Random-hyperplane LSH: each table hashes a row to the sign pattern of
+    # `bits` projections. More tables raise recall, more bits cut candidates.
+    def __init__(self, index, bits=12, tables=8, seed=0, block_size=4096):
+        self.bits, self.block_size = bits, block_size
+        self.planes = np.zeros((0, bits * tables), dtype=np.float32)
+        self._start(index, seed)
+        self.keys = self._hash(index.tfidf_matrix())
+        self.tables = self._tables(self.keys)
+
+    def _add_terms(self, count):
+        planes = self.rng.standard_normal((count, self.planes.shape[1])).astype(np.float32)
+        self.planes = np.concatenate([self.planes, planes])
+
+    def _hash(self, matrix):
+        tables = self.planes.shape[1] // self.bits
+        weights = (1 << np.arange(self.bits)).astype(np.int64)
+        keys = np.empty((matrix.shape[0], tables), dtype=np.int64)
+        for start in range(0, matrix.shape[0], self.block_size):
+            projected = np.asarray(matrix[start:start + self.block_size] @ self.planes)
+            signs = (projected > 0).reshape(-1, tables, self.bits)
+            keys[start:start + self.block_size] = signs @ weights
+        return keys
+
+    def _tables(self, keys):
+        tables = []
+        for t in range(keys.shape[1]):
+            buckets, labels = np.unique(keys[:, t], return_inverse=True)
+            tables.append(dict(zip(buckets.tolist(), _inverted_lists(labels, len(buckets)))))
+        return tables
+
+    def _place(self, rows, fresh, matrix):
+        keys = np.empty((len(rows), self.keys.shape[1]), dtype=np.int64)
+        kept = rows >= 0
+        keys[kept] = self.keys[rows[kept]]
+        keys[fresh] = self._hash(matrix)
+        self.keys, self.tables = keys, self._tables(keys)
+
+    def candidates(self, row):
+        buckets = [table[self.keys[row, t]] for t, table in enumerate(self.tables)]
+        return np.unique(np.concatenate(buckets))
+
+    def top_matches(self, row, k):
+        return score_candidates(self.index, row, self.candidates(row), k)
+
+
+class IVFSearch(_IncrementalSearch):
+    # Inverted-file index over TruncatedSVD-reduced vectors: rows are grouped
+    # by their nearest k-means centroid and a query scans `probes` groups.
+    # Rows added later are reduced with the stored SVD and assigned to the
+    # nearest existing centroid; terms the SVD never saw are left out.
+    def __init__(self, index, components=64, clusters=None, probes=4, seed=0):
+        self.probes = probes
+        self._start(index, seed)
+        matrix = index.tfidf_matrix()
+        n, features = matrix.shape
+        clusters = min(clusters or max(1, int(np.sqrt(n))), n)
+        if features < 2 or clusters < 2:
+            self.svd = None
+            self.reduced = np.zeros((n, 1), dtype=np.float32)
+            self.centroids = np.ones((1, 1), dtype=np.float32)
+            self.labels = np.zeros(n, dtype=np.intp)
+            self.lists = [np.arange(n)]
+            return
+        self.svd = TruncatedSVD(min(components, features - 1), random_state=seed)
+        self.reduced = normalize(self.svd.fit_transform(matrix)).astype(np.float32)
+        kmeans = MiniBatchKMeans(clusters, random_state=seed, n_init=3).fit(self.reduced)
+        self.centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+        self.labels = kmeans.labels_
+        self.lists = _inverted_lists(self.labels, clusters)
+
+    def _place(self, rows, fresh, matrix):
+        kept = rows >= 0
+        reduced = np.zeros((len(rows), self.reduced.shape[1]), dtype=np.float32)
+        labels = np.zeros(len(rows), dtype=self.labels.dtype)
+        reduced[kept], labels[kept] = self.reduced[rows[kept]], self.labels[rows[kept]]
+        if self.svd is not None and len(fresh):
+            components = self.svd.components_
+            matrix = matrix[:, :components.shape[1]]
+            reduced[fresh] = normalize(np.asarray(matrix @ components.T)).astype(np.float32)
+            labels[fresh] = np.argmax(reduced[fresh] @ self.centroids.T, axis=1)
+        self.reduced, self.labels = reduced, labels
+        self.lists = _inverted_lists(labels, len(self.centroids))
+
+    def candidates(self, row):
+        nearest = top_k(self.centroids @ self.reduced[row], self.probes)
+        return np.sort(np.concatenate([self.lists[c] for c in nearest]))
+
+    def top_matches(self, row, k):
+        return score_candidates(self.index, row, self.candidates(row), k)
+
+
+BACKENDS = {
+    'exact': ExactSearch,
+    'lsh': LSHSearch,
+    'ivf': IVFSearch,
+}
+
+
+def configure_backend(name, **options):
+    global BACKEND, BACKEND_OPTIONS
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown match backend: {name}")
+    with _lock:
+        BACKEND, BACKEND_OPTIONS = name, options
+        _backends.clear()
+
+
+def search_backend(index):
+    with _lock:
+        # Backends are built from one index snapshot; a write replaces the
+        # index object, and the next search refreshes the backend for it.
+        path = Connection.current_path()
+        backend = _backends.get(path)
+        if backend is None:
+            with timer(f'ann_build_{BACKEND}'):
+                backend = _backends[path] = BACKENDS[BACKEND](index, **BACKEND_OPTIONS)
+        elif backend.index is not index:
+            with timer(f'ann_refresh_{BACKEND}'):
+                backend = _backends[path] = backend.refreshed(index)
+        return backend
+
+
+def evaluate_recall(index, backend, k=10, sample=500, seed=0):
+    exact = ExactSearch(index)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), size=min(sample, len(index)), replace=False)
+    recalls, exact_time, approximate_time = [], 0.0, 0.0
+    for row in rows:
+        started = time.perf_counter()
+        expected, expected_scores = exact.top_matches(row, k)
+        exact_time += time.perf_counter() - started
+        started = time.perf_counter()
+        _, found_scores = backend.top_matches(row, k)
+        approximate_time += time.perf_counter() - started
+        # Compared by score so that equally similar students count as hits
+        # whichever of them a backend happens to return.
+        if len(expected):
+            hits = np.count_nonzero(found_scores >= expected_scores[-1] - 1e-12)
+            recalls.append(min(hits, len(expected)) / len(expected))
+    return {
+        'queries': len(rows),
+        'k': k,
+        'recall': float(np.mean(recalls)) if recalls else 1.0,
+        'exact_ms': 1000 * exact_time / max(len(rows), 1),
+        'approximate_ms': 1000 * approximate_time / max(len(rows), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall of an approximate match backend against exact TF-IDF cosine.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--backend', choices=['lsh', 'ivf'], default='lsh')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=500, help="students used as queries")
+    parser.add_argument('--bits', type=int, default=12, help="lsh: hyperplanes per table")
+    parser.add_argument('--tables', type=int, default=8, help="lsh: hash tables")
+    parser.add_argument('--components', type=int, default=64, help="ivf: TruncatedSVD dimensions")
+    parser.add_argument('--clusters', type=int, default=None, help="ivf: k-means lists (default sqrt(N))")
+    parser.add_argument('--probes', type=int, default=4, help="ivf: lists scanned per query")
+    args = parser.parse_args()
+
+    Connection.configure(args.db)
+    with Connection.connection() as conn:
+        index = get_index(conn, Connection.index_path())
+    if args.backend == 'lsh':
+        options = {'bits': args.bits, 'tables': args.tables}
+    else:
+        options = {'components': args.components, 'clusters': args.clusters, 'probes': args.probes}
+
+    started = time.perf_counter()
+    backend = BACKENDS[args.backend](index, **options)
+    build_time = time.perf_counter() - started
+    result = evaluate_recall(index, backend, args.k, args.sample)
+    print(f"{args.backend} {options}: built in {build_time:.2f}s")
+    print(f"recall@{result['k']} = {result['recall']:.3f} over {result['queries']} queries, "
+          f"{result['approximate_ms']:.3f} ms/query vs {result['exact_ms']:.3f} ms exact")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import Connection
+import Engine
+import Metrics
+from Metrics import increment, timer
+from Worker import recommend_async, submit
+
+MAX_K = 100
+MAX_BATCH = 1000
+
+# SQLite and numpy block, so every handler hands its work to the shared
+# recommender pool (Worker.py) and awaits the future; identical requests in
+# flight share one computation.
+
+
+def _contacts(matches):
+    return [{'name': name, 'email': email} for name, email in matches]
+
+
+def _int_param(request, name, default, low, high):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _error(status, message):
+    increment(f'api_errors_{status}')
+    return JSONResponse({'error': message}, status_code=status)
+
+
+async def recommendations(request):
+    user_id = request.path_params['user_id']
+    with timer('api_recommendations'):
+        try:
+            k = _int_param(request, 'k', None, 1, MAX_K)
+            offset = _int_param(request, 'offset', 0, 0, 10 * MAX_K)
+        except ValueError as e:
+            return _error(400, str(e))
+        exists = await asyncio.wrap_future(submit(('exists', user_id), Engine.student_exists, user_id))
+        if not exists:
+            return _error(404, f"unknown user_id {user_id}")
+        matches = await asyncio.wrap_future(recommend_async(user_id, k, offset))
+        return JSONResponse({'user_id': user_id, 'offset': offset, 'matches': _contacts(matches)})
+
+
+async def batch_recommendations(request):
+    with timer('api_batch_recommendations'):
+        try:
+            body = await request.json()
+            user_ids = [str(user_id) for user_id in body['user_ids']]
+            k = body.get('k')
+            if k is not None and not 1 <= int(k) <= MAX_K:
+                raise ValueError(f"k must be between 1 and {MAX_K}")
+        except (ValueError, KeyError, TypeError) as e:
+            return _error(400, f"expected a JSON body with user_ids and an optional k: {e}")
+        if len(user_ids) > MAX_BATCH:
+            return _error(400, f"at most {MAX_BATCH} user_ids per request")
+        key = ('bulk', tuple(user_ids), k)
+        results = await asyncio.wrap_future(submit(key, Engine.bulk_recommend, user_ids, k and int(k)))
+        return JSONResponse({'results': {user_id: _contacts(matches) for user_id, matches in results.items()}})
+
+
+def _check_database():
+    with Connection.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+
+
+async def health(request):
+    try:
+        students = await asyncio.wrap_future(submit(('health',), _check_database))
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'error': str(e)}, status_code=503)
+    return JSONResponse({'status': 'ok', 'pid': os.getpid(), 'students': students})
+
+
+async def metrics(request):
+    return PlainTextResponse(Metrics.prometheus_text(), media_type='text/plain; version=0.0.4')
+
+
+async def metrics_json(request):
+    return JSONResponse(Metrics.snapshot())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Schema, index and roster are loaded before the first request rather
+    # than by it.
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, Engine.open_database)
+    await loop.run_in_executor(None, Engine.bulk_recommend, [])
+    yield
+
+
+app = Starlette(routes=[
+    Route('/recommendations/{user_id}', recommendations),
+    Route('/recommendations', batch_recommendations, methods=['POST']),
+    Route('/health', health),
+    Route('/metrics', metrics),
+    Route('/metrics.json', metrics_json),
+], lifespan=lifespan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recommendations over HTTP.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    Connection.configure(args.db)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
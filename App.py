@@ -1,7 +1,13 @@
+import time
+started = time.perf_counter()
 import streamlit as st
 from Student import student_login, student_registration, student_main
 from Admin import admin_login, manage_students
-from Database import create_table
+from Engine import open_database
+import Metrics
+# Only the first run in a process actually imports anything; reruns find
+# the modules in sys.modules.
+Metrics.observe('app_imports', time.perf_counter() - started)
 
 # Set the page config
 st.set_page_config(page_title="Knowledge Based Recommender System", layout="wide", page_icon="logo.jpg")
@@ -39,8 +45,15 @@ st.markdown("""
 st.markdown('<div class="title">Knowledge Based Recommender System</div>', unsafe_allow_html=True)
 st.markdown('<div class="quote">Networking is not just about connecting people; it\'s about connecting people with ideas, and opportunities</div>', unsafe_allow_html=True)
 
-# Initialize the database
-create_table()
+# Streamlit re-executes this script on every interaction; the schema check
+# and metrics server only need to happen once per process.
+@st.cache_resource
+def initialize():
+    open_database()
+    Metrics.start_server()
+    Metrics.set_gauge('app_cold_start_seconds', time.perf_counter() - started)
+
+initialize()
 
 # Session state management
 if 'user_type' not in st.session_state:
@@ -57,6 +70,7 @@ def logout():
     st.session_state['username'] = ""
     st.session_state['user_type'] = None
     st.session_state['show_registration'] = False
+    st.session_state.pop('match_pages', None)
     st.success("You have been logged out!")
 
 # Main application logic
@@ -90,4 +104,5 @@ def login_form():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    Metrics.flush()
\ No newline at end of file
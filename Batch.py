@@ -0,0 +1,138 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+import Connection
+from Connection import connection, index_path
+from Cache import invalidate
+from ChangeLog import consume_changes, last_change
+from Database import create_table
+from Ranking import profile_arrays, rank_rows, uses_profiles
+from Recommender import get_index, index_version, load_index
+from Settings import DEFAULTS, get_settings, record_batch_depth
+
+_matrix = None
+_transposed = None
+_ids = None
+_weights = None
+_profile_arrays = ()
+
+
+def _init_worker(path, version, weights, profiles):
+    # Each worker maps the published store itself rather than being sent a
+    # pickled copy of the matrix.
+    global _matrix, _transposed, _ids, _weights, _profile_arrays
+    index = load_index(path, version)
+    _matrix = index.tfidf_matrix()
+    _transposed = index.postings().T
+    _ids = np.asarray(index.ids, dtype=np.int64)
+    _weights = weights
+    _profile_arrays = profiles
+
+
+def _match_block(block, k):
+    start, stop = block
+    rows = []
+    for row, columns, values in rank_rows(_matrix, _transposed, np.arange(start, stop), k, _weights, _profile_arrays):
+        student_id = int(_ids[row])
+        rows.extend((student_id, rank, int(match_id), float(score))
+                    for rank, (match_id, score) in enumerate(zip(_ids[columns], values), start=1))
+    return rows
+
+
+def compute_matches(path, version, count, k=10, block_size=512, workers=None, weights=DEFAULTS, profiles=()):
+    # Yields the match rows of each block of the index at `version`, in
+    # order, as they are ranked. Only a few blocks per worker are in flight
+    # at once, so memory doesn't grow with the roster.
+    workers = workers or os.cpu_count()
+    blocks = ((start, min(start + block_size, count)) for start in range(0, count, block_size))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(path, version, weights, profiles)) as pool:
+        pending = deque(pool.submit(_match_block, block, k) for block in islice(blocks, 2 * workers))
+        while pending:
+            rows = pending.popleft().result()
+            block = next(blocks, None)
+            if block is not None:
+                pending.append(pool.submit(_match_block, block, k))
+            yield rows
+
+
+def write_matches(conn, blocks, k, seq=None):
+    # Blocks of rows, at most k per student, are staged in a temporary table
+    # as they arrive, which locks nothing in the database, then swapped in
+    # in one transaction. seq is the last logged change the rows account for.
+    conn.execute('DROP TABLE IF EXISTS temp.student_matches_staging')
+    conn.execute('''
+        CREATE TEMP TABLE student_matches_staging (
+            student_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            match_id INTEGER NOT NULL,
+            score REAL NOT NULL
+        )
+    ''')
+    try:
+        count = 0
+        for rows in blocks:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO student_matches_staging (student_id, rank, match_id, score)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+            count += len(rows)
+        with conn:
+            if seq is not None:
+                consume_changes(conn, seq)
+            conn.execute('DELETE FROM student_matches')
+            record_batch_depth(conn, k)
+            conn.execute('''
+                INSERT INTO student_matches (student_id, rank, match_id, score)
+                SELECT student_id, rank, match_id, score FROM student_matches_staging
+                ORDER BY student_id, rank
+            ''')
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.student_matches_staging')
+    return count
+
+
+def run_batch(k=10, block_size=512, workers=None):
+    create_table()
+    path = index_path()
+    with connection() as conn:
+        # Read first: changes logged after this are still in the index
+        # below, but left for Maintenance.py to apply again.
+        seq = last_change(conn)
+        get_index(conn, path)
+        # Pinned, so the workers and the profiles below see the same rows
+        # even if a write publishes a newer version meanwhile.
+        version = index_version(path)
+        index = load_index(path, version)
+        weights = get_settings()
+        profiles = profile_arrays(conn, index) if uses_profiles(weights) else ()
+        blocks = compute_matches(path, version, len(index), k, block_size, workers, weights, profiles)
+        count = write_matches(conn, blocks, k, seq)
+        invalidate('matches')
+        return len(index), count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute top-k matches for every student.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--k', type=int, default=10,
+                        help="matches stored per student; pages past them are ranked live")
+    parser.add_argument('--block-size', type=int, default=512, help="rows scored per task")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+    Connection.configure(args.db)
+
+    started = time.perf_counter()
+    students, matches = run_batch(args.k, args.block_size, args.workers)
+    print(f"Stored {matches} matches for {students} students in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
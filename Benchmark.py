@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import Connection
+import Database
+from Cache import invalidate
+from Credentials import hash_password
+from Database import create_table
+from Recommender import get_index
+from Tags import backfill_tags
+
+DEPARTMENTS = ['CSE', 'IT', 'AIDS', 'AIML', 'ECE', 'EEE', 'EIE', 'MECH', 'CIVIL', 'CHEM', 'BIOTECH', 'AUTO']
+PASSWORD = 'benchmark'
+TOPICS = [
+    'Python', 'Java', 'C Programming', 'C++', 'JavaScript', 'Web Development', 'Android Development',
+    'Machine Learning', 'Deep Learning', 'Artificial Intelligence', 'Data Science', 'Data Analytics',
+    'Computer Vision', 'Natural Language Processing', 'Cloud Computing', 'DevOps', 'Cyber Security',
+    'Ethical Hacking', 'Blockchain', 'Internet of Things', 'Embedded Systems', 'Robotics', 'VLSI Design',
+    'Signal Processing', 'Power Systems', 'Renewable Energy', 'Electric Vehicles', 'CAD Design',
+    'Automobile Engineering', 'Thermodynamics', 'Structural Engineering', 'Surveying', 'Biotechnology',
+    'Graphic Designing', 'UI UX Design', 'Photography', 'Video Editing', 'Content Writing',
+    'Public Speaking', 'Entrepreneurship', 'Stock Market', 'Competitive Programming', 'Open Source',
+    'Game Development', 'Music', 'Football', 'Cricket', 'Chess', 'Drone Technology', 'Quantum Computing',
+]
+# What a fresh Streamlit worker imports before it can draw the login page.
+STARTUP_SCRIPT = 'import time; started = time.perf_counter(); import Student, Admin; print(time.perf_counter() - started)'
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def synthetic_students(n, seed=0):
+    # Interest popularity follows a Zipf-like curve and each department leans
+    # towards its own slice of topics, so term frequencies resemble a real
+    # intake rather than uniform noise.
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    for i in range(n):
+        department = DEPARTMENTS[min(int(rng.paretovariate(1.2)) - 1, len(DEPARTMENTS) - 1)]
+        offset = DEPARTMENTS.index(department) * 4
+        topics = TOPICS[offset:] + TOPICS[:offset]
+        interests = ', '.join(dict.fromkeys(rng.choices(topics, weights, k=rng.randint(1, 5))))
+        yield (f'Student {i}', department, rng.randint(1, 4), interests, f'student{i}', f'9{i:09d}',
+               f'student{i}@example.edu', f'U{i:07d}', '')
+
+
+def generate_roster(path, n, seed=0, batch_size=10_000):
+    Connection.configure(path)
+    create_table()
+    # Hashing a million passwords would dominate generation, so every
+    # synthetic account shares one hash of PASSWORD.
+    password_hash = hash_password(PASSWORD)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA synchronous = OFF')
+        rows = synthetic_students(n, seed)
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            with conn:
+                conn.executemany('''
+                    INSERT INTO students (name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+                conn.executemany('INSERT INTO credentials (user_id, password_hash) VALUES (?, ?)',
+                                 [(row[7], password_hash) for row in batch])
+        with conn:
+            backfill_tags(conn)
+    finally:
+        conn.close()
+
+
+def measure(func, args_list, before=None):
+    # The first call doubles as warm-up and is the one traced for peak
+    # memory; tracemalloc overhead would distort the timed calls. before,
+    # if given, runs untimed ahead of each call.
+    tracemalloc.start()
+    func(*args_list[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings = []
+    for args in args_list[1:]:
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return dict(summarize(timings), peak_kb=peak / 1024)
+
+
+def summarize(timings):
+    timings = np.array(timings) * 1000
+    return {
+        'runs': len(timings),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'max_ms': float(timings.max()),
+    }
+
+
+def measure_startup(runs):
+    # Every run is a new interpreter, so nothing is already in sys.modules.
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output))
+    return summarize(timings)
+
+
+def benchmark_size(n, runs, seed=0):
+    db_path = Connection.DB_PATH
+    workdir = tempfile.mkdtemp(prefix='kbrs-bench-')
+    try:
+        path = os.path.join(workdir, 'students.db')
+        started = time.perf_counter()
+        generate_roster(path, n, seed)
+        results = {'generate_s': time.perf_counter() - started}
+        Connection.configure(path)
+
+        rng = random.Random(seed + 1)
+        users = [(f'U{rng.randrange(n):07d}',) for _ in range(runs + 1)]
+        logins = [(user_id, PASSWORD) for user_id, in users]
+        pages = [(rng.randrange(max(n // 50, 1)), 50) for _ in range(runs + 1)]
+        new_students = [(f'New {i}', 'CSE', 1, 'Python, Machine Learning', None, None, f'new{i}@example.edu', f'N{i:07d}', 'x')
+                        for i in range(runs + 1)]
+
+        # Caches are bypassed through __wrapped__ so every run does the work;
+        # find_matches also reads the cached ranked_matches, so that
+        # namespace is cleared before each call.
+        with Connection.connection() as conn:
+            started = time.perf_counter()
+            get_index(conn, Connection.index_path())
+            results['index_build_s'] = time.perf_counter() - started
+        results['find_matches'] = measure(Database.find_matches.__wrapped__, users, lambda: invalidate('matches'))
+        results['verify_user'] = measure(Database.verify_user, logins)
+        results['get_students_page'] = measure(Database.get_students_page.__wrapped__, pages)
+        results['get_students'] = measure(Database.get_students.__wrapped__, [()] * (min(runs, 5) + 1))
+        results['add_student'] = measure(Database.add_student, new_students)
+        return results
+    finally:
+        Connection.configure(db_path)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold, floor_ms):
+    # Sub-millisecond timings are mostly scheduler noise, so anything under
+    # floor_ms is never reported.
+    regressions = []
+    groups = [(size, functions, baseline.get('sizes', {}).get(size, {})) for size, functions in results['sizes'].items()]
+    groups.append(('startup', results.get('startup', {}), baseline.get('startup', {})))
+    for size, functions, previous_functions in groups:
+        for name, stats in functions.items():
+            previous = previous_functions.get(name)
+            if isinstance(stats, dict) and isinstance(previous, dict) \
+                    and stats['p95_ms'] > max(previous['p95_ms'] * threshold, floor_ms):
+                regressions.append(f"{name} @ {size}: p95 {previous['p95_ms']:.2f} ms -> {stats['p95_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Database.py against synthetic rosters.")
+    parser.add_argument('--sizes', default='1k,10k', help="comma separated roster sizes, e.g. 1k,10k,100k,1m")
+    parser.add_argument('--runs', type=int, default=20, help="timed calls per function")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write JSON results to this file instead of stdout")
+    parser.add_argument('--baseline', help="previous JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="allowed p95 slowdown against the baseline")
+    parser.add_argument('--startup-runs', type=int, default=5, help="fresh interpreters to time the app imports in")
+    parser.add_argument('--floor-ms', type=float, default=1.0, help="ignore regressions below this p95")
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'startup': {'import_app': measure_startup(args.startup_runs)},
+        'sizes': {},
+    }
+    for size in args.sizes.split(','):
+        n = parse_size(size)
+        print(f"Benchmarking {n} students...", file=sys.stderr)
+        results['sizes'][str(n)] = benchmark_size(n, args.runs, args.seed)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.floor_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Connection
+from Connection import connection, index_path
+from Database import create_table, STUDENT_COLUMNS
+from Cache import invalidate
+from Credentials import hash_password, forget
+from Recommender import index_add_students, index_hooks, index_replace_students
+from Roster import COLUMNS, roster_add_students, roster_replace_students
+from Tags import set_many_student_tags
+
+IMPORT_COLUMNS = ['name', 'department', 'year', 'interests', 'linkedin_id', 'phone_number', 'email', 'user_id', 'password']
+REQUIRED_COLUMNS = ['name', 'department', 'year', 'interests', 'email', 'user_id', 'password']
+CHUNK_SIZE = 500
+
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    name = getattr(path, 'name', path)
+    return 'parquet' if str(name).lower().endswith('.parquet') else 'csv'
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet import/export needs the optional 'pyarrow' package.")
+    return pyarrow, pyarrow.parquet
+
+
+def read_rows(source, fmt=None, chunk_size=CHUNK_SIZE):
+    # Yields (row_number, record) pairs without loading the whole file.
+    if _format(source, fmt) == 'parquet':
+        _, parquet = _parquet()
+        row_number = 1
+        for batch in parquet.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            for record in batch.to_pylist():
+                row_number += 1
+                yield row_number, record
+        return
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8') as f:
+            yield from read_rows(f, 'csv')
+        return
+    if isinstance(source, io.BufferedIOBase) or not isinstance(source, io.TextIOBase):
+        source = io.TextIOWrapper(source, encoding='utf-8', newline='')
+    for row_number, record in enumerate(csv.DictReader(source), start=2):
+        yield row_number, record
+
+
+def _cell(value):
+    # Empty cells arrive as None or NaN, and a year column holding an empty
+    # cell as floats.
+    if value is None or value != value:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def validate(record, required=REQUIRED_COLUMNS):
+    values = {column: _cell(record.get(column)) for column in IMPORT_COLUMNS}
+    missing = [column for column in required if not values[column]]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    try:
+        values['year'] = int(float(values['year']))
+    except ValueError:
+        return None, f"year '{values['year']}' is not a number"
+    if not 1 <= values['year'] <= 4:
+        return None, f"year {values['year']} is not between 1 and 4"
+    return tuple(values[column] for column in IMPORT_COLUMNS), None
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _existing_keys(conn, chunk):
+    emails = [row[6] for _, row in chunk]
+    user_ids = [row[7] for _, row in chunk]
+    c = conn.execute(f'''
+        SELECT email, user_id FROM students
+        WHERE email IN ({",".join("?" * len(emails))}) OR user_id IN ({",".join("?" * len(user_ids))})
+    ''', emails + user_ids)
+    existing = c.fetchall()
+    return {email for email, _ in existing}, {user_id for _, user_id in existing}
+
+
+INSERT_SQL = '''
+    INSERT INTO students (name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, '')
+'''
+CREDENTIALS_SQL = 'INSERT INTO credentials (user_id, password_hash) VALUES (?, ?)'
+
+
+def _tag_new_rows(conn, last_id):
+    set_many_student_tags(conn, conn.execute('SELECT id, interests FROM students WHERE id > ?', (last_id,)).fetchall())
+
+
+def _insert_chunk(conn, chunk, conflicts):
+    # The KDF releases the GIL, so a chunk's passwords hash in parallel and
+    # before the transaction opens.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        hashes = list(pool.map(hash_password, [row[8] for _, row in chunk]))
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+    try:
+        with conn:
+            conn.executemany(INSERT_SQL, [row[:8] for _, row in chunk])
+            conn.executemany(CREDENTIALS_SQL, [(row[7], password_hash) for (_, row), password_hash in zip(chunk, hashes)])
+            _tag_new_rows(conn, last_id)
+        return len(chunk)
+    except sqlite3.IntegrityError:
+        pass
+    # Another writer took a key between the check and the insert; retry the
+    # chunk row by row so only the offending rows are reported.
+    inserted = 0
+    with conn:
+        for (row_number, row), password_hash in zip(chunk, hashes):
+            try:
+                conn.execute(INSERT_SQL, row[:8])
+                conn.execute(CREDENTIALS_SQL, (row[7], password_hash))
+                inserted += 1
+            except sqlite3.IntegrityError as e:
+                conflicts.append((row_number, str(e)))
+        _tag_new_rows(conn, last_id)
+    return inserted
+
+
+def import_students(source, fmt=None, chunk_size=CHUNK_SIZE):
+    create_table()
+    conflicts = []
+    seen_emails, seen_user_ids = set(), set()
+    inserted = 0
+
+    def valid_rows():
+        for row_number, record in read_rows(source, fmt, chunk_size):
+            row, error = validate(record)
+            if error:
+                conflicts.append((row_number, error))
+            elif row[6] in seen_emails:
+                conflicts.append((row_number, f"duplicate email {row[6]} in file"))
+            elif row[7] in seen_user_ids:
+                conflicts.append((row_number, f"duplicate user_id {row[7]} in file"))
+            else:
+                seen_emails.add(row[6])
+                seen_user_ids.add(row[7])
+                yield row_number, row
+
+    with connection() as conn:
+        first_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+        for chunk in _chunks(valid_rows(), chunk_size):
+            emails, user_ids = _existing_keys(conn, chunk)
+            fresh = []
+            for row_number, row in chunk:
+                if row[6] in emails:
+                    conflicts.append((row_number, f"email {row[6]} already exists"))
+                elif row[7] in user_ids:
+                    conflicts.append((row_number, f"user_id {row[7]} already exists"))
+                else:
+                    fresh.append((row_number, row))
+            if fresh:
+                inserted += _insert_chunk(conn, fresh, conflicts)
+        if inserted:
+            with index_hooks(index_path()):
+                index_add_students(conn, conn.execute('SELECT id, interests FROM students WHERE id > ? ORDER BY id', (first_id,)),
+                                   index_path())
+                roster_add_students(conn.execute(f'SELECT {COLUMNS} FROM students WHERE id > ?', (first_id,)))
+            invalidate('students', 'matches')
+    conflicts.sort()
+    return {'inserted': inserted, 'conflicts': conflicts}
+
+
+UPDATE_REQUIRED = [column for column in REQUIRED_COLUMNS if column != 'password']
+UPSERT_SQL = '''
+    INSERT INTO students (id, name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, '')
+    ON CONFLICT (id) DO UPDATE SET
+        name = excluded.name, department = excluded.department, year = excluded.year,
+        interests = excluded.interests, linkedin_id = excluded.linkedin_id,
+        phone_number = excluded.phone_number, email = excluded.email, user_id = excluded.user_id
+'''
+RENAME_CREDENTIALS_SQL = 'UPDATE credentials SET user_id = ? WHERE user_id = ?'
+PASSWORD_SQL = '''
+    INSERT INTO credentials (user_id, password_hash) VALUES (?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET password_hash = excluded.password_hash
+'''
+
+
+def diff_students(original, edited):
+    # Grid records against the page they were edited from: rows without an
+    # id are inserts, rows whose values changed are updates and ids missing
+    # from edited are deletes. Rows are labelled as the admin sees them.
+    before = {int(record['id']): record for record in original}
+    inserts, updates, kept = [], [], set()
+    for position, record in enumerate(edited, start=1):
+        student_id = record.get('id')
+        if student_id is None or student_id != student_id:
+            inserts.append((f"new row {position}", record))
+            continue
+        student_id = int(student_id)
+        kept.add(student_id)
+        old = before.get(student_id)
+        if old is not None and any(_cell(record.get(column)) != _cell(old.get(column)) for column in IMPORT_COLUMNS):
+            updates.append((f"id {student_id}", student_id, record))
+    deletes = [student_id for student_id in before if student_id not in kept]
+    return inserts, updates, deletes
+
+
+def _run(conn, statements):
+    for sql, rows in statements:
+        conn.executemany(sql, [params for _, params in rows])
+
+
+def _find_conflicts(conn, statements):
+    # Replays the statements row by row, each under a savepoint, to name
+    # every row that breaks a constraint; nothing is kept.
+    conflicts = []
+    conn.execute('BEGIN')
+    try:
+        for sql, rows in statements:
+            for label, params in rows:
+                conn.execute('SAVEPOINT grid_row')
+                try:
+                    conn.execute(sql, params)
+                except sqlite3.IntegrityError as e:
+                    conn.execute('ROLLBACK TO grid_row')
+                    conflicts.append((label, str(e)))
+                conn.execute('RELEASE grid_row')
+    finally:
+        conn.rollback()
+    return conflicts
+
+
+def apply_student_edits(original, edited):
+    # All inserts, updates and deletes of one grid save commit together or,
+    # when any row conflicts, not at all; the index and roster are then
+    # refreshed once for the whole batch.
+    inserts, updates, deletes = diff_students(original, edited)
+    result = {'inserted': 0, 'updated': 0, 'deleted': 0, 'conflicts': []}
+    conflicts = result['conflicts']
+    new_rows, changed_rows = [], []
+    for label, record in inserts:
+        row, error = validate(record)
+        if error:
+            conflicts.append((label, error))
+        else:
+            new_rows.append((label, row))
+    for label, student_id, record in updates:
+        row, error = validate(record, UPDATE_REQUIRED)
+        if error:
+            conflicts.append((label, error))
+        else:
+            changed_rows.append((label, student_id, row))
+    if conflicts or not (new_rows or changed_rows or deletes):
+        return result
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        passwords = [row[8] for _, row in new_rows] + [row[8] for _, _, row in changed_rows if row[8]]
+        hashes = iter(list(pool.map(hash_password, passwords)))
+    with connection() as conn:
+        ids = deletes + [student_id for _, student_id, _ in changed_rows]
+        previous = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            previous.update(conn.execute(f'SELECT id, user_id FROM students WHERE id IN ({",".join("?" * len(chunk))})', chunk))
+        for label, student_id, _ in changed_rows:
+            if student_id not in previous:
+                conflicts.append((label, f"student {student_id} no longer exists"))
+        if conflicts:
+            return result
+        deleted = [(f"id {student_id}", student_id) for student_id in deletes if student_id in previous]
+
+        new_credentials = [(label, (row[7], next(hashes))) for label, row in new_rows]
+        renames = [(label, (row[7], previous[student_id])) for label, student_id, row in changed_rows
+                   if row[7] != previous[student_id]]
+        passwords = [(label, (row[7], next(hashes))) for label, _, row in changed_rows if row[8]]
+        statements = [
+            ('DELETE FROM credentials WHERE user_id = ?', [(label, (previous[student_id],)) for label, student_id in deleted]),
+            ('DELETE FROM students WHERE id = ?', [(label, (student_id,)) for label, student_id in deleted]),
+            ('DELETE FROM student_interests WHERE student_id = ?', [(label, (student_id,)) for label, student_id in deleted]),
+            (UPSERT_SQL, [(label, (student_id,) + row[:8]) for label, student_id, row in changed_rows]),
+            (RENAME_CREDENTIALS_SQL, renames),
+            (PASSWORD_SQL, passwords),
+            (INSERT_SQL, [(label, row[:8]) for label, row in new_rows]),
+            (CREDENTIALS_SQL, new_credentials),
+        ]
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+        try:
+            with conn:
+                _run(conn, statements)
+                set_many_student_tags(conn, [(student_id, row[3]) for _, student_id, row in changed_rows])
+                _tag_new_rows(conn, last_id)
+        except sqlite3.IntegrityError:
+            conflicts.extend(_find_conflicts(conn, statements))
+            return result
+        stale = [previous[student_id] for _, student_id in deleted]
+        stale += [old for _, (_, old) in renames] + [user_id for _, (user_id, _) in passwords]
+        for user_id in stale:
+            forget(user_id)
+
+        changed = [student_id for _, student_id, _ in changed_rows]
+        rows = conn.execute(f'''
+            SELECT id, interests FROM students WHERE id > ? OR id IN ({",".join("?" * len(changed))}) ORDER BY id
+        ''', [last_id] + changed).fetchall()
+        with index_hooks(index_path()):
+            index_replace_students(conn, rows, [student_id for _, student_id in deleted], index_path())
+            roster_replace_students(conn.execute(f'''
+                SELECT {COLUMNS} FROM students WHERE id > ? OR id IN ({",".join("?" * len(changed))})
+            ''', [last_id] + changed), [student_id for _, student_id in deleted])
+        invalidate('students', 'matches')
+    result.update(inserted=len(new_rows), updated=len(changed_rows), deleted=len(deleted))
+    return result
+
+
+def export_students(destination, fmt=None, chunk_size=CHUNK_SIZE):
+    # Passwords are never exported.
+    fmt = _format(destination, fmt)
+    exported = 0
+    with connection() as conn:
+        c = conn.execute(f'SELECT {", ".join(STUDENT_COLUMNS)} FROM students ORDER BY id')
+        if fmt == 'parquet':
+            pyarrow, parquet = _parquet()
+            writer = None
+            while rows := c.fetchmany(chunk_size):
+                table = pyarrow.Table.from_pylist([dict(zip(STUDENT_COLUMNS, row)) for row in rows])
+                if writer is None:
+                    writer = parquet.ParquetWriter(destination, table.schema)
+                writer.write_table(table)
+                exported += len(rows)
+            if writer is not None:
+                writer.close()
+            return exported
+        f = open(destination, 'w', newline='', encoding='utf-8') if isinstance(destination, (str, os.PathLike)) else destination
+        try:
+            writer = csv.writer(f)
+            writer.writerow(STUDENT_COLUMNS)
+            while rows := c.fetchmany(chunk_size):
+                writer.writerows(rows)
+                exported += len(rows)
+        finally:
+            if f is not destination:
+                f.close()
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export students.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None, help="defaults to the file extension")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows per transaction")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('import', help="load students from a file").add_argument('path')
+    commands.add_parser('export', help="write students to a file").add_argument('path')
+    args = parser.parse_args()
+    Connection.configure(args.db)
+
+    started = time.perf_counter()
+    if args.command == 'import':
+        result = import_students(args.path, args.format, args.chunk_size)
+        for row_number, message in result['conflicts']:
+            print(f"row {row_number}: {message}", file=sys.stderr)
+        print(f"Imported {result['inserted']} students, {len(result['conflicts'])} rows rejected "
+              f"in {time.perf_counter() - started:.2f}s")
+    else:
+        exported = export_students(args.path, args.format, args.chunk_size)
+        print(f"Exported {exported} students in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TTL = float(os.environ.get('CACHE_TTL', '60'))
+MAXSIZE = int(os.environ.get('CACHE_MAXSIZE', '1024'))
+
+_caches = {}
+
+
+class TTLCache:
+    # LRU mapping whose entries also expire after `ttl` seconds. The ttl only
+    # bounds staleness from writes made by other processes; writes in this
+    # process clear the affected namespace straight away via invalidate().
+    def __init__(self, maxsize=MAXSIZE, ttl=TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            # A value computed before the last clear() may predate the write
+            # that caused it, so it is returned to its caller but not kept.
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cache_for(namespace, maxsize=MAXSIZE, ttl=TTL):
+    cache = _caches.get(namespace)
+    if cache is None:
+        cache = _caches.setdefault(namespace, TTLCache(maxsize, ttl))
+    return cache
+
+
+def _database():
+    # Imported here: Connection imports Metrics, which imports this module.
+    from Connection import current_path
+    return current_path()
+
+
+def cached(namespace, maxsize=MAXSIZE, ttl=TTL):
+    def decorator(func):
+        cache = cache_for(namespace, maxsize, ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Per database file, so shards never see each other's entries.
+            key = (_database(), func.__name__, args, tuple(sorted(kwargs.items())))
+            generation = cache.generation
+            found, value = cache.get(key)
+            if not found:
+                value = func(*args, **kwargs)
+                cache.set(key, value, generation)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate(*namespaces):
+    for namespace in namespaces:
+        cache = _caches.get(namespace)
+        if cache is not None:
+            cache.clear()
+
+
+def stats():
+    return {namespace: {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)}
+            for namespace, cache in _caches.items()}
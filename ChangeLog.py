@@ -0,0 +1,59 @@
+TRIGGERS = ('students_log_insert', 'students_log_delete', 'students_log_update')
+
+
+def create_change_log(conn):
+    # Every write that can move a student's matches leaves a row here, from
+    # whichever code path made it; names and emails are read at query time,
+    # so they are not logged. Only while student_matches holds something
+    # to maintain: without Batch.py the log would only ever grow.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS student_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            kind TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_log_insert AFTER INSERT ON students
+        WHEN EXISTS (SELECT 1 FROM student_matches) BEGIN
+            INSERT INTO student_changes (student_id, kind) VALUES (new.id, 'insert');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_log_delete AFTER DELETE ON students
+        WHEN EXISTS (SELECT 1 FROM student_matches) BEGIN
+            INSERT INTO student_changes (student_id, kind) VALUES (old.id, 'delete');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_log_update AFTER UPDATE OF department, year, interests ON students
+        WHEN EXISTS (SELECT 1 FROM student_matches) BEGIN
+            INSERT INTO student_changes (student_id, kind) VALUES (new.id, 'update');
+        END
+    ''')
+    conn.execute('DELETE FROM student_changes WHERE NOT EXISTS (SELECT 1 FROM student_matches)')
+
+
+def migrate_change_log(conn):
+    # The first triggers logged unconditionally.
+    for trigger in TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    create_change_log(conn)
+
+
+def last_change(conn):
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM student_changes').fetchone()[0]
+
+
+def pending_changes(conn, limit):
+    return conn.execute('SELECT seq, student_id, kind FROM student_changes ORDER BY seq LIMIT ?', (limit,)).fetchall()
+
+
+def consume_changes(conn, seq):
+    # Inside the transaction that brought student_matches up to seq.
+    conn.execute('DELETE FROM student_changes WHERE seq <= ?', (seq,))
+
+
+def clear_changes(conn):
+    # With student_matches emptied there is nothing left to apply them to.
+    conn.execute('DELETE FROM student_changes')
@@ -0,0 +1,145 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from Metrics import increment, set_gauge, timer
+
+DB_PATH = os.environ.get('STUDENTS_DB', 'students.db')
+POOL_SIZE = int(os.environ.get('STUDENTS_DB_POOL_SIZE', '8'))
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+_lock = threading.Lock()
+_pools = {}
+# Set by using(); None means DB_PATH.
+_database = ContextVar('database', default=None)
+
+
+def _statement_metric(sql):
+    words = sql.split(None, 1)
+    return f'sql_{words[0].lower()}' if words else 'sql'
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        with timer(_statement_metric(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        with timer(_statement_metric(sql)):
+            return super().executemany(sql, parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Routes every statement through TimedCursor so SQL time shows up in
+    # Metrics, split by statement kind (sql_select, sql_insert, ...).
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        # check_same_thread is off because a connection may be handed to a
+        # different thread on its next checkout; the pool never shares one
+        # between two threads at the same time. cached_statements keeps the
+        # compiled statements of each pooled connection warm across requests.
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256,
+                               factory=TimedConnection)
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        increment('db_connections_opened')
+        return conn
+
+    def acquire(self):
+        increment('db_checkouts')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            increment('db_connections_closed')
+        set_gauge('db_pool_idle', self._idle.qsize())
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def current_path():
+    return _database.get() or DB_PATH
+
+
+def get_pool():
+    path = current_path()
+    with _lock:
+        pool = _pools.get(path)
+        # A forked worker must not reuse connections opened by its parent.
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def configure(path, size=POOL_SIZE):
+    global DB_PATH
+    with _lock:
+        pool = _pools.pop(DB_PATH, None)
+        if pool is not None and pool.pid == os.getpid():
+            pool.close()
+        DB_PATH = path
+        _pools[path] = ConnectionPool(path, size)
+
+
+def index_path():
+    return os.path.splitext(current_path())[0] + '.index'
+
+
+@contextmanager
+def using(path):
+    # Points connection(), index_path() and everything keyed on them (the
+    # index, roster and caches) at another database file for the current
+    # thread or task only; Shards.py runs each shard's work inside one.
+    token = _database.set(path)
+    try:
+        yield
+    finally:
+        _database.reset(token)
+
+
+@contextmanager
+def connection():
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Connection import connection
+from Metrics import increment, timer
+
+# Work factors for new hashes. Stored hashes carry their own parameters, so
+# these can be raised at any time; older hashes are upgraded on next login.
+KDF = os.environ.get('PASSWORD_KDF', 'scrypt')
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', '600000'))
+CACHE_TTL = float(os.environ.get('CREDENTIAL_CACHE_TTL', '300'))
+CACHE_SIZE = int(os.environ.get('CREDENTIAL_CACHE_SIZE', '1024'))
+
+_lock = threading.Lock()
+_recent = OrderedDict()
+# Cached entries hold an HMAC of the password under a per-process key rather
+# than the password itself.
+_cache_key = secrets.token_bytes(32)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _derive(password, algorithm, params, salt):
+    if algorithm == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params[0], dklen=32)
+    raise ValueError(f"Unknown password KDF: {algorithm}")
+
+
+def _current_params():
+    return (SCRYPT_N, SCRYPT_R, SCRYPT_P) if KDF == 'scrypt' else (PBKDF2_ITERATIONS,)
+
+
+def hash_password(password):
+    salt = secrets.token_bytes(16)
+    params = _current_params()
+    digest = _derive(password, KDF, params, salt)
+    return '$'.join([KDF, ','.join(map(str, params)), _b64(salt), _b64(digest)])
+
+
+def check_password(password, encoded):
+    algorithm, params, salt, digest = encoded.split('$')
+    params = tuple(int(value) for value in params.split(','))
+    with timer('password_kdf'):
+        derived = _derive(password, algorithm, params, base64.b64decode(salt))
+    return hmac.compare_digest(derived, base64.b64decode(digest))
+
+
+def needs_rehash(encoded):
+    algorithm, params, _, _ = encoded.split('$')
+    return algorithm != KDF or tuple(int(value) for value in params.split(',')) != _current_params()
+
+
+_dummy_hash = None
+
+
+def _dummy():
+    # Unknown user ids are checked against a throwaway hash so a failed login
+    # costs the same whether or not the account exists.
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    return _dummy_hash
+
+
+def create_credentials_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS credentials (
+            user_id TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def set_password(conn, user_id, password, password_hash=None):
+    # Runs inside the caller's transaction alongside the students write.
+    conn.execute('''
+        INSERT INTO credentials (user_id, password_hash) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET password_hash = excluded.password_hash
+    ''', (user_id, password_hash or hash_password(password)))
+    forget(user_id)
+
+
+def rename_credentials(conn, user_id, new_user_id):
+    conn.execute('UPDATE credentials SET user_id = ? WHERE user_id = ?', (new_user_id, user_id))
+    forget(user_id)
+
+
+def delete_credentials(conn, user_id):
+    conn.execute('DELETE FROM credentials WHERE user_id = ?', (user_id,))
+    forget(user_id)
+
+
+def migrate_credentials(conn, batch_size=500):
+    # Moves plaintext passwords out of students into salted hashes and blanks
+    # the old column; rows that already have credentials are left alone.
+    while True:
+        rows = conn.execute('''
+            SELECT s.user_id, s.password FROM students s
+            WHERE s.password != '' AND NOT EXISTS (SELECT 1 FROM credentials c WHERE c.user_id = s.user_id)
+            LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not rows:
+            break
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            hashes = list(pool.map(hash_password, [password for _, password in rows]))
+        conn.executemany('INSERT INTO credentials (user_id, password_hash) VALUES (?, ?)',
+                         [(user_id, password_hash) for (user_id, _), password_hash in zip(rows, hashes)])
+        conn.executemany("UPDATE students SET password = '' WHERE user_id = ?", [(user_id,) for user_id, _ in rows])
+    conn.execute("UPDATE students SET password = '' WHERE password != ''")
+
+
+def _fingerprint(user_id, password, password_hash):
+    return hmac.new(_cache_key, f'{user_id}\0{password}\0{password_hash}'.encode(), hashlib.sha256).digest()
+
+
+def _remember(user_id, password, password_hash):
+    with _lock:
+        _recent[user_id] = (time.monotonic() + CACHE_TTL, _fingerprint(user_id, password, password_hash))
+        _recent.move_to_end(user_id)
+        while len(_recent) > CACHE_SIZE:
+            _recent.popitem(last=False)
+
+
+def _recently_verified(user_id, password, password_hash):
+    with _lock:
+        entry = _recent.get(user_id)
+        if entry is None:
+            return False
+        if entry[0] <= time.monotonic():
+            del _recent[user_id]
+            return False
+    return hmac.compare_digest(entry[1], _fingerprint(user_id, password, password_hash))
+
+
+def forget(user_id):
+    with _lock:
+        _recent.pop(user_id, None)
+
+
+def reject_unknown(password):
+    # Spends the same time as a wrong password so unknown user ids don't
+    # stand out.
+    check_password(password, _dummy())
+    return False
+
+
+def verify_credentials(user_id, password):
+    # The stored hash is read on every login and is part of the cached
+    # fingerprint, so a password changed or deleted by another process
+    # stops matching at once; only the KDF is skipped on a hit.
+    with connection() as conn:
+        row = conn.execute('SELECT password_hash FROM credentials WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None:
+        forget(user_id)
+        return reject_unknown(password)
+    if _recently_verified(user_id, password, row[0]):
+        increment('credential_cache_hits')
+        return True
+    increment('credential_cache_misses')
+    if not check_password(password, row[0]):
+        return False
+    password_hash = row[0]
+    if needs_rehash(password_hash):
+        password_hash = hash_password(password)
+        with connection() as conn, conn:
+            set_password(conn, user_id, password, password_hash)
+    _remember(user_id, password, password_hash)
+    return True
@@ -1,15 +1,32 @@
+import os
 import sqlite3
-import pandas as pd
-import streamlit as st
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from Connection import get_pool, connection, index_path
+from Cache import cached, invalidate
+from ChangeLog import create_change_log, migrate_change_log
+from Credentials import create_credentials_table, migrate_credentials, hash_password, set_password, rename_credentials, delete_credentials, verify_credentials
+from Search import create_search_table, rebuild_search, search_query, bm25_candidates
+from Settings import batch_depth, create_settings_table, get_settings
+from Tags import create_tag_tables, backfill_tags, set_student_tags, delete_student_tags, tag_candidates
+
+# 'tags' scores only students sharing a whole interest tag, found through the
+# student_interests index; 'bm25' scores the best MATCH_BM25_CANDIDATES
+# students by one FTS5 query over their interests; 'all' hands the roster to
+# the configured match backend, whose exact scorer already skips students
+# with no common term.
+MATCH_CANDIDATES = os.environ.get('MATCH_CANDIDATES', 'all')
+BM25_CANDIDATES = int(os.environ.get('MATCH_BM25_CANDIDATES', '1000'))
+SCHEMA_VERSION = 4
+# How far down each student's ranking is kept for "more matches" pages.
+RANKED_DEPTH = int(os.environ.get('MATCH_RANKED_DEPTH', '100'))
+
+# numpy, pandas, the roster and the recommender (scipy, scikit-learn) are
+# imported inside the functions that use them, so the login page never pays
+# for them.
 def create_connection():
-    conn = sqlite3.connect('students.db')
-    return conn
+    return get_pool().connect()
 
 def create_table():
-    conn = create_connection()
-    with conn:
+    with connection() as conn, conn:
         conn.execute('''
             CREATE TABLE IF NOT EXISTS students (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,85 +41,255 @@ def create_table():
                 password TEXT NOT NULL
             )
         ''')
-    conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS student_matches (
+                student_id INTEGER NOT NULL,
+                rank INTEGER NOT NULL,
+                match_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (student_id, rank)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_student_matches_match ON student_matches (match_id)')
+        create_tag_tables(conn)
+        create_credentials_table(conn)
+        create_settings_table(conn)
+        create_search_table(conn)
+        create_change_log(conn)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            backfill_tags(conn)
+        if version < 2:
+            migrate_credentials(conn)
+        if version < 3:
+            rebuild_search(conn)
+        if version < 4:
+            migrate_change_log(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
 def add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password):
-    conn = create_connection()
-    try:
-        with conn:
-            conn.execute('''
-                INSERT INTO students (name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, department, year, interests, linkedin_id, phone_number, email, user_id, password))
+    # Hashed before the transaction so the KDF never holds the write lock;
+    # the students.password column is kept empty, credentials hold the hash.
+    password_hash = hash_password(password)
+    with connection() as conn:
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    INSERT INTO students (name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, '')
+                ''', (name, department, year, interests, linkedin_id, phone_number, email, user_id))
+                set_student_tags(conn, cursor.lastrowid, interests)
+                set_password(conn, user_id, password, password_hash)
+        except sqlite3.IntegrityError:
+            return False
+        from Recommender import index_add_student, index_hooks
+        from Roster import roster_set_student
+        with index_hooks(index_path()):
+            index_add_student(conn, cursor.lastrowid, interests, index_path())
+            roster_set_student(cursor.lastrowid, name, department, year, email, user_id)
+        invalidate('students', 'matches')
+        return True
+
+def update_student(student_id, name, department, year, interests, linkedin_id, phone_number, password='',
+                   email=None, user_id=None):
+    # An empty password keeps the current one, as do email and user_id left
+    # as None. Returns False for an unknown id or an email/user_id in use.
+    password_hash = hash_password(password) if password else None
+    with connection() as conn:
+        try:
+            with conn:
+                previous = conn.execute('SELECT name, department, year, interests, user_id, email FROM students WHERE id = ?', (student_id,)).fetchone()
+                if previous is None:
+                    return False
+                email, user_id = email or previous[5], user_id or previous[4]
+                conn.execute('''
+                    UPDATE students
+                    SET name = ?, department = ?, year = ?, interests = ?, linkedin_id = ?, phone_number = ?, email = ?, user_id = ?
+                    WHERE id = ?
+                ''', (name, department, year, interests, linkedin_id, phone_number, email, user_id, student_id))
+                set_student_tags(conn, student_id, interests)
+                if user_id != previous[4]:
+                    rename_credentials(conn, previous[4], user_id)
+                if password_hash:
+                    set_password(conn, user_id, password, password_hash)
+        except sqlite3.IntegrityError:
+            return False
+        from Recommender import index_hooks, index_update_student
+        from Roster import roster_set_student
+        with index_hooks(index_path()):
+            index_update_student(conn, student_id, interests, index_path())
+            roster_set_student(student_id, name, department, year, email, user_id)
+        invalidate('students')
+        # Match lists show name and email; the department and year blend
+        # weights make rankings depend on those as well as on interests.
+        if previous != (name, department, year, interests, user_id, email):
+            invalidate('matches')
         return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
 
 def verify_user(user_id, password):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM students WHERE user_id = ? AND password = ?', (user_id, password))
-    user_found = c.fetchone() is not None
-    conn.close()
-    return user_found
+    return verify_credentials(user_id, password)
 
-def find_matches(user_id):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute('SELECT name, interests, email FROM students')
-    students = c.fetchall()
+@cached('matches')
+def ranked_matches(user_id, depth=RANKED_DEPTH):
+    # Student ids of the best `depth` matches, best first. Only the top
+    # `depth` scores are partially selected and sorted; every page of
+    # find_matches is then a slice of this cached list.
+    import numpy as np
+    from Ann import search_backend
+    from Ranking import rank
+    from Recommender import FEATURIZATION, get_index
+    from Roster import get_roster
+    with connection() as conn:
+        student_id = get_roster(conn).student_id(user_id)
+        if student_id is None:
+            return []
 
-    if not students:
-        return []
+        index = get_index(conn, index_path())
+        row = index.row_of(student_id)
+        if MATCH_CANDIDATES in ('tags', 'bm25'):
+            if MATCH_CANDIDATES == 'tags':
+                found = tag_candidates(conn, student_id)
+            else:
+                found = bm25_candidates(conn, student_id, BM25_CANDIDATES)
+            candidate_rows = (index.row_of(i) for i in found)
+            candidates = np.array(sorted(r for r in candidate_rows if r is not None), dtype=np.intp)
+        else:
+            candidates = search_backend(index).candidates(row)
+        if candidates is None and FEATURIZATION == 'stream':
+            from Streaming import stream_rank
+            rows, _ = stream_rank(conn, index, row, depth, get_settings())
+        else:
+            rows, _ = rank(conn, index, row, depth, get_settings(), candidates)
+    return [index.ids[i] for i in rows]
 
-    student_names = [student[0] for student in students]
-    interests = [student[1] for student in students]
-    student_emails = [student[2] for student in students]
+@cached('matches')
+def find_matches(user_id, k=None, offset=0):
+    k = k or get_settings()['match_count']
+    match_ids = ranked_matches(user_id, max(RANKED_DEPTH, offset + k))[offset:offset + k]
+    from Roster import get_roster
+    with connection() as conn:
+        return get_roster(conn).contacts(match_ids)
 
-    interests_lower = [interest.lower() for interest in interests]
+@cached('matches')
+def get_precomputed_matches(user_id, k=None, offset=0):
+    k = k or get_settings()['match_count']
+    with connection() as conn:
+        c = conn.execute('''
+            SELECT s.name, s.email
+            FROM students u
+            JOIN student_matches m ON m.student_id = u.id
+            JOIN students s ON s.id = m.match_id
+            WHERE u.user_id = ?
+            ORDER BY m.rank
+            LIMIT ? OFFSET ?
+        ''', (user_id, k, offset))
+        return c.fetchall()
 
-    tfidf = TfidfVectorizer()
-    tfidf_matrix = tfidf.fit_transform(interests_lower)
-    cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
+@cached('matches')
+def count_precomputed_matches(user_id):
+    with connection() as conn:
+        return conn.execute('''
+            SELECT COUNT(*)
+            FROM students u
+            JOIN student_matches m ON m.student_id = u.id
+            WHERE u.user_id = ?
+        ''', (user_id,)).fetchone()[0]
 
-    c.execute('SELECT name, interests FROM students WHERE user_id = ?', (user_id,))
-    user_data = c.fetchone()
-    conn.close()
+@cached('matches')
+def precomputed_depth():
+    with connection() as conn:
+        return batch_depth(conn)
 
-    if user_data is None:
-        return []
+@cached('students')
+def get_students():
+    import pandas as pd
+    with connection() as conn:
+        return pd.read_sql_query('SELECT * FROM students', conn)
 
-    user_name, user_interests = user_data
-    user_interests_lower = user_interests.lower()
+STUDENT_COLUMNS = ['id', 'name', 'department', 'year', 'interests', 'linkedin_id', 'phone_number', 'email', 'user_id']
+SEARCH_COLUMNS = ['name', 'department', 'interests', 'email', 'user_id']
 
-    user_index = student_names.index(user_name)
-    sim_scores = list(enumerate(cosine_sim[user_index]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+def _search_clause(search):
+    if not search:
+        return '', []
+    pattern = f'%{search}%'
+    return 'WHERE ' + ' OR '.join(f'{column} LIKE ?' for column in SEARCH_COLUMNS), [pattern] * len(SEARCH_COLUMNS)
 
-    match_indices = [i for i, score in sim_scores if i != user_index and score > 0]
-    available_matches = [(student_names[i], student_emails[i]) for i in match_indices][:2]
+@cached('students')
+def count_students(search=''):
+    where, params = _search_clause(search)
+    with connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM students {where}', params).fetchone()[0]
 
-    return available_matches
+@cached('students')
+def get_students_page(page=0, page_size=50, sort_by='id', descending=False, search=''):
+    if sort_by not in STUDENT_COLUMNS:
+        sort_by = 'id'
+    direction = 'DESC' if descending else 'ASC'
+    where, params = _search_clause(search)
+    import pandas as pd
+    with connection() as conn:
+        return pd.read_sql_query(f'''
+            SELECT {', '.join(STUDENT_COLUMNS)} FROM students {where}
+            ORDER BY {sort_by} {direction}, id {direction}
+            LIMIT ? OFFSET ?
+        ''', conn, params=params + [page_size, page * page_size])
 
-def get_students():
-    conn = create_connection()
-    df = pd.read_sql_query('SELECT * FROM students', conn)
-    conn.close()
-    return df
+@cached('students')
+def count_search_results(search):
+    query = search_query(search)
+    if query is None:
+        return 0
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM student_search WHERE student_search MATCH ?', (query,)).fetchone()[0]
+
+@cached('students')
+def search_students(search, page=0, page_size=50):
+    # Full-text matches on name, department and interests, best bm25 first.
+    import pandas as pd
+    query = search_query(search)
+    if query is None:
+        return pd.DataFrame(columns=STUDENT_COLUMNS)
+    columns = ', '.join(f's.{column}' for column in STUDENT_COLUMNS)
+    with connection() as conn:
+        return pd.read_sql_query(f'''
+            SELECT {columns} FROM student_search f
+            JOIN students s ON s.id = f.rowid
+            WHERE student_search MATCH ?
+            ORDER BY f.rank, s.id
+            LIMIT ? OFFSET ?
+        ''', conn, params=[query, page_size, page * page_size])
+
+@cached('students')
+def get_student(student_id):
+    with connection() as conn:
+        c = conn.execute(f'SELECT {", ".join(STUDENT_COLUMNS)} FROM students WHERE id = ?', (student_id,))
+        row = c.fetchone()
+    if row is None:
+        return None
+    return dict(zip(STUDENT_COLUMNS, row))
 
 def delete_student(student_id):
-    conn = create_connection()
-    try:
-        with conn:
-            conn.execute('DELETE FROM students WHERE id = ?', (student_id,))
+    with connection() as conn:
+        try:
+            with conn:
+                row = conn.execute('SELECT user_id FROM students WHERE id = ?', (student_id,)).fetchone()
+                if row is not None:
+                    delete_credentials(conn, row[0])
+                conn.execute('DELETE FROM students WHERE id = ?', (student_id,))
+                delete_student_tags(conn, student_id)
+        except sqlite3.Error:
+            return False
+        from Recommender import index_delete_student, index_hooks
+        from Roster import roster_delete_student
+        with index_hooks(index_path()):
+            index_delete_student(conn, student_id, index_path())
+            roster_delete_student(student_id)
+        invalidate('students', 'matches')
         return True
-    except Exception as e:
-        return False
-    finally:
-        conn.close()
 def logout():
+    import streamlit as st
     st.session_state['logged_in'] = False
     st.session_state['username'] = ""
     st.session_state['user_type'] = None
\ No newline at end of file
@@ -0,0 +1,167 @@
+import os
+from contextlib import nullcontext
+
+import Connection
+import Database
+from Connection import connection, index_path, using
+from Database import count_precomputed_matches, create_table, find_matches, get_precomputed_matches, precomputed_depth
+from Settings import get_settings
+
+# The recommender without any Streamlit: App.py renders it, and scripts,
+# benchmarks and services call these functions directly. Heavy modules are
+# still imported on first use, as in Database.
+BULK_BLOCK_SIZE = 512
+# 'database' keeps every student in the one file at Connection.DB_PATH;
+# 'shards' spreads them over per-campus (or per-department) files, Shards.py.
+STORAGE = os.environ.get('STUDENT_STORAGE', 'database')
+
+
+def _shards():
+    if STORAGE != 'shards':
+        return None
+    import Shards
+    return Shards
+
+
+def _student_id(user_id):
+    from Roster import get_roster
+    with connection() as conn:
+        return get_roster(conn).student_id(user_id)
+
+
+def open_database(path=None):
+    if path:
+        Connection.configure(path)
+    create_table()
+    if _shards():
+        _shards().open_directory()
+
+
+def shard_names():
+    # The shards the admin page browses one at a time; None without shards.
+    return _shards().shards() if _shards() else None
+
+
+def on_shard(shard):
+    # Database reads inside run against one shard's file.
+    return using(_shards().shard_path(shard)) if shard else nullcontext()
+
+
+def asks_campus():
+    # Whether registering needs a campus to place the student in a shard.
+    return _shards() is not None and _shards().SHARD_KEY == 'campus'
+
+
+def add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password, campus=None):
+    if _shards():
+        return _shards().add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id,
+                                     password, campus)
+    return Database.add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+
+
+def update_student(user_id, name, department, year, interests, linkedin_id, phone_number, password='',
+                   email=None, new_user_id=None):
+    if _shards():
+        return _shards().update_student(user_id, name, department, year, interests, linkedin_id, phone_number,
+                                        password, email, new_user_id)
+    student_id = _student_id(user_id)
+    return student_id is not None and Database.update_student(
+        student_id, name, department, year, interests, linkedin_id, phone_number, password, email, new_user_id)
+
+
+def delete_student(user_id):
+    if _shards():
+        return _shards().delete_student(user_id)
+    student_id = _student_id(user_id)
+    return student_id is not None and Database.delete_student(student_id)
+
+
+def verify_user(user_id, password):
+    if _shards():
+        return _shards().verify_user(user_id, password)
+    return Database.verify_user(user_id, password)
+
+
+def student_exists(user_id):
+    if _shards():
+        return _shards().student_exists(user_id)
+    return _student_id(user_id) is not None
+
+
+def recommend(user_id, k=None, offset=0):
+    if _shards():
+        return _shards().find_matches(user_id, k, offset)
+    # Pages within the depth Batch.py ranked to come from its table, where
+    # a shorter list means the student ran out of matches; pages past it,
+    # and students it hasn't ranked yet, are ranked live.
+    k = k or get_settings()['match_count']
+    depth = precomputed_depth()
+    if depth is not None and offset + k <= depth and count_precomputed_matches(user_id):
+        return get_precomputed_matches(user_id, k, offset)
+    return find_matches(user_id, k, offset)
+
+
+def bulk_recommend(user_ids, k=None):
+    # Exact matches for many students from one sparse product per block,
+    # rather than one find_matches call each. Unknown user ids map to [].
+    shards = _shards()
+    if shards is None:
+        return _bulk_recommend(user_ids, k)
+    results = {user_id: [] for user_id in user_ids}
+    if shards.MATCH_SCOPE != 'local':
+        results.update((user_id, shards.find_matches(user_id, k)) for user_id in results)
+        return results
+    # One block product per shard, over the students it holds.
+    by_shard = {}
+    for user_id in results:
+        shard = shards.shard_of(user_id)
+        if shard is not None:
+            by_shard.setdefault(shard, []).append(user_id)
+    for shard, members in by_shard.items():
+        with using(shards.shard_path(shard)):
+            results.update(_bulk_recommend(members, k))
+    return results
+
+
+def _bulk_recommend(user_ids, k=None):
+    from Ranking import profile_arrays, rank_rows, uses_profiles
+    from Recommender import get_index
+    from Roster import get_roster
+    settings = get_settings()
+    k = k or settings['match_count']
+    results = {user_id: [] for user_id in user_ids}
+    with connection() as conn:
+        roster = get_roster(conn)
+        index = get_index(conn, index_path())
+        profiles = profile_arrays(conn, index) if uses_profiles(settings) else ()
+        wanted = []
+        for user_id in results:
+            row = index.row_of(roster.student_id(user_id))
+            if row is not None:
+                wanted.append((row, user_id))
+        wanted.sort()
+        matrix = index.tfidf_matrix()
+        # The postings are the CSC form of matrix, so their transpose is
+        # matrix.T in CSR form without another copy.
+        transposed = index.postings().T
+        for start in range(0, len(wanted), BULK_BLOCK_SIZE):
+            block = wanted[start:start + BULK_BLOCK_SIZE]
+            ranked = rank_rows(matrix, transposed, [row for row, _ in block], k, settings, profiles)
+            for (_, user_id), (_, columns, _) in zip(block, ranked):
+                results[user_id] = roster.contacts([index.ids[column] for column in columns])
+    return results
+
+
+def import_students(source, fmt=None):
+    from Bulk import import_students
+    return import_students(source, fmt)
+
+
+def export_students(destination, fmt=None):
+    from Bulk import export_students
+    return export_students(destination, fmt)
+
+
+def apply_student_edits(original, edited):
+    from Bulk import apply_student_edits
+    return apply_student_edits(original, edited)
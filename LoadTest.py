@@ -0,0 +1,98 @@
+import argparse
+import http.client
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+def sample_users(db_path, count, seed=0):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        user_ids = [row[0] for row in conn.execute('SELECT user_id FROM students')]
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    return rng.sample(user_ids, min(count, len(user_ids)))
+
+
+def _client(host, port, paths, deadline, latencies, errors):
+    # One keep-alive connection per client thread, like a pooled caller.
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def run(host, port, user_ids, concurrency, duration, k=None):
+    query = f'?k={k}' if k else ''
+    paths = [f'/recommendations/{user_id}{query}' for user_id in user_ids]
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = []
+    for c in range(concurrency):
+        # Each client walks the users from a different starting point.
+        offset = c * len(paths) // concurrency
+        thread = threading.Thread(target=_client, args=(host, port, paths[offset:] + paths[:offset], deadline, latencies, errors))
+        thread.start()
+        threads.append(thread)
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    timings = np.array(latencies or [0.0]) * 1000
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the recommendation API and report requests/sec.")
+    parser.add_argument('--db', default='students.db', help="database to sample user ids from")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--users', type=int, default=1000, help="distinct users requested")
+    parser.add_argument('--concurrency', default='1,8,32', help="comma separated client counts")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument('--k', type=int, help="matches per request (default: the admin setting)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    user_ids = sample_users(args.db, args.users, args.seed)
+    results = []
+    for concurrency in map(int, args.concurrency.split(',')):
+        result = run(args.host, args.port, user_ids, concurrency, args.duration, args.k)
+        print(f"{concurrency:>4} clients: {result['requests_per_s']:8.1f} req/s  "
+              f"p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  errors {result['errors']}", file=sys.stderr)
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+import Connection
+from Connection import connection, index_path
+from Cache import invalidate
+from ChangeLog import consume_changes, pending_changes
+from Database import create_table
+from Ranking import blend, profile_arrays, rank_rows, uses_profiles
+from Recommender import get_index
+from Settings import batch_depth, get_settings
+
+BLOCK_SIZE = 512
+# Stored scores predate the change's shift in term weights, so a student is
+# refreshed when a changed profile scores within this much of their k-th.
+MARGIN = float(os.environ.get('MAINTENANCE_MARGIN', '0.05'))
+
+
+def _query(conn, sql, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        yield from conn.execute(sql.format(','.join('?' * len(chunk))), chunk)
+
+
+def affected_students(conn, index, changed, deleted, depth, weights, profiles=()):
+    # Whose stored top-k a change can move: the changed students themselves,
+    # everyone whose list names a changed or deleted student, and, of the
+    # students sharing a term with a changed profile, those it now scores
+    # high enough against to enter their list.
+    rows = sorted(row for row in map(index.row_of, changed) if row is not None)
+    affected = {index.ids[row] for row in rows}
+    affected.update(student_id for student_id, in _query(
+        conn, 'SELECT DISTINCT student_id FROM student_matches WHERE match_id IN ({})', changed | deleted))
+    if rows:
+        matrix = index.tfidf_matrix()
+        sharing = np.unique(index.postings()[:, np.unique(matrix[rows].indices)].indices)
+        pairs = (matrix[sharing] @ matrix[rows].T).tocsc()
+        best = np.full(len(sharing), -np.inf)
+        for column, row in enumerate(rows):
+            hits = pairs.indices[pairs.indptr[column]:pairs.indptr[column + 1]]
+            values = pairs.data[pairs.indptr[column]:pairs.indptr[column + 1]]
+            keep = (values > 0) & (sharing[hits] != row)
+            hits = hits[keep]
+            np.maximum.at(best, hits, blend(values[keep], sharing[hits], row, weights, *profiles))
+        candidates = {index.ids[row]: score for row, score in zip(sharing, best) if score > -np.inf}
+        lowest = {student_id: (count, score) for student_id, count, score in _query(
+            conn, 'SELECT student_id, COUNT(*), MIN(score) FROM student_matches WHERE student_id IN ({}) GROUP BY student_id',
+            candidates)}
+        for student_id, score in candidates.items():
+            count, kth = lowest.get(student_id, (0, None))
+            if count < depth or score >= kth - MARGIN:
+                affected.add(student_id)
+    return affected - deleted
+
+
+def refresh_changed(limit=10000):
+    # Applies up to `limit` logged changes to student_matches. The cost
+    # follows the students affected, not the roster; idf drift from the
+    # changed document counts is left to the next full Batch.py run.
+    create_table()
+    with connection() as conn:
+        changes = pending_changes(conn, limit)
+        if not changes:
+            return 0, 0
+        last_seq = changes[-1][0]
+        depth = batch_depth(conn)
+        if depth is None:
+            # Nothing precomputed to maintain.
+            with conn:
+                consume_changes(conn, last_seq)
+            return len(changes), 0
+
+        deleted = {student_id for _, student_id, kind in changes if kind == 'delete'}
+        changed = {student_id for _, student_id, _ in changes} - deleted
+        index = get_index(conn, index_path())
+        weights = get_settings()
+        profiles = profile_arrays(conn, index) if uses_profiles(weights) else ()
+        affected = affected_students(conn, index, changed, deleted, depth, weights, profiles)
+        rows = sorted(row for row in map(index.row_of, affected) if row is not None)
+        ids = np.asarray(index.ids, dtype=np.int64)
+        matrix = index.tfidf_matrix()
+        transposed = index.postings().T
+        matches = []
+        for start in range(0, len(rows), BLOCK_SIZE):
+            for row, columns, values in rank_rows(matrix, transposed, rows[start:start + BLOCK_SIZE], depth, weights, profiles):
+                matches.extend((int(ids[row]), rank, int(match_id), float(score))
+                               for rank, (match_id, score) in enumerate(zip(ids[columns], values), start=1))
+        with conn:
+            conn.executemany('DELETE FROM student_matches WHERE student_id = ?', [(student_id,) for student_id in affected | deleted])
+            conn.executemany('''
+                INSERT INTO student_matches (student_id, rank, match_id, score)
+                VALUES (?, ?, ?, ?)
+            ''', matches)
+            consume_changes(conn, last_seq)
+        invalidate('matches')
+        return len(changes), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep precomputed matches up to date from the change log.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between polls")
+    parser.add_argument('--limit', type=int, default=10000, help="changes applied per pass")
+    parser.add_argument('--once', action='store_true', help="apply pending changes and exit")
+    args = parser.parse_args()
+    Connection.configure(args.db)
+
+    while True:
+        started = time.perf_counter()
+        changes, refreshed = refresh_changed(args.limit)
+        if changes:
+            print(f"Applied {changes} changes, refreshed {refreshed} students in {time.perf_counter() - started:.2f}s")
+        if args.once and changes < args.limit:
+            return
+        if changes < args.limit:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
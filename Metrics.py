@@ -0,0 +1,175 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Cache
+
+METRICS_PORT = os.environ.get('METRICS_PORT')
+METRICS_FILE = os.environ.get('METRICS_FILE')
+FLUSH_INTERVAL = 5.0
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SAMPLES = 1024
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+_gauges = {}
+_server = None
+_last_flush = 0.0
+
+
+class Timing:
+    # Prometheus-style cumulative buckets plus a bounded window of recent
+    # samples, which is what the percentiles in snapshot() are taken from.
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def observe(name, seconds):
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = Timing()
+        timing.observe(seconds)
+
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot():
+    with _lock:
+        timings = {
+            name: {
+                'count': timing.count,
+                'mean_ms': 1000 * timing.total / timing.count,
+                'p50_ms': 1000 * timing.percentile(0.5),
+                'p95_ms': 1000 * timing.percentile(0.95),
+                'max_ms': 1000 * timing.max,
+            }
+            for name, timing in sorted(_timings.items())
+        }
+        counters = dict(sorted(_counters.items()))
+        gauges = dict(sorted(_gauges.items()))
+    caches = {}
+    for namespace, stats in Cache.stats().items():
+        lookups = stats['hits'] + stats['misses']
+        caches[namespace] = dict(stats, hit_rate=stats['hits'] / lookups if lookups else 0.0)
+    return {'pid': os.getpid(), 'timings': timings, 'counters': counters, 'gauges': gauges, 'caches': caches}
+
+
+def prometheus_text():
+    lines = ['# TYPE kbrs_duration_seconds histogram']
+    with _lock:
+        for name, timing in sorted(_timings.items()):
+            for bound, count in zip(BUCKETS, timing.buckets):
+                lines.append(f'kbrs_duration_seconds_bucket{{name="{name}",le="{bound}"}} {count}')
+            lines.append(f'kbrs_duration_seconds_bucket{{name="{name}",le="+Inf"}} {timing.count}')
+            lines.append(f'kbrs_duration_seconds_sum{{name="{name}"}} {timing.total}')
+            lines.append(f'kbrs_duration_seconds_count{{name="{name}"}} {timing.count}')
+        lines.append('# TYPE kbrs_events_total counter')
+        lines.extend(f'kbrs_events_total{{name="{name}"}} {value}' for name, value in sorted(_counters.items()))
+        lines.append('# TYPE kbrs_gauge gauge')
+        lines.extend(f'kbrs_gauge{{name="{name}"}} {value}' for name, value in sorted(_gauges.items()))
+    lines.append('# TYPE kbrs_cache_hits_total counter')
+    lines.append('# TYPE kbrs_cache_misses_total counter')
+    lines.append('# TYPE kbrs_cache_entries gauge')
+    for namespace, stats in Cache.stats().items():
+        lines.append(f'kbrs_cache_hits_total{{namespace="{namespace}"}} {stats["hits"]}')
+        lines.append(f'kbrs_cache_misses_total{{namespace="{namespace}"}} {stats["misses"]}')
+        lines.append(f'kbrs_cache_entries{{namespace="{namespace}"}} {stats["size"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_json(path):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def flush(path=METRICS_FILE):
+    global _last_flush
+    if not path or time.monotonic() - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = time.monotonic()
+    write_json(path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = prometheus_text(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(snapshot()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=METRICS_PORT, host='127.0.0.1'):
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return _server
+        _server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    return _server
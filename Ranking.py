@@ -0,0 +1,110 @@
+import threading
+
+import numpy as np
+
+from Metrics import timer
+from Recommender import score_query, score_row, top_k
+from Roster import get_roster
+
+# Years run 1 to 4, so a gap of 3 is as far apart as two students can be.
+YEAR_SPAN = 3
+
+_lock = threading.Lock()
+_ids = None
+
+
+def uses_profiles(weights):
+    return bool(weights['department_weight'] or weights['year_weight'])
+
+
+def profile_arrays(conn, index):
+    # Department codes and years aligned with the rows of index, gathered
+    # from the roster's id-positioned columns in one vectorized lookup.
+    global _ids
+    with _lock:
+        if _ids is None or _ids[0] is not index:
+            _ids = index, np.asarray(index.ids, dtype=np.intp)
+        ids = _ids[1]
+    return get_roster(conn).profiles(ids)
+
+
+def blend(scores, candidates, row, weights, departments=None, years=None):
+    department = departments[row] if weights['department_weight'] else None
+    year = years[row] if weights['year_weight'] else None
+    return blend_profile(scores, candidates, department, year, weights, departments, years)
+
+
+def blend_profile(scores, candidates, department, year, weights, departments=None, years=None):
+    # Interest similarity plus a bonus for sharing a department and one that
+    # shrinks linearly with the gap between years. department is a code in
+    # departments' roster and year a year of study.
+    blended = weights['interest_weight'] * scores
+    if weights['department_weight']:
+        blended += weights['department_weight'] * ((departments[candidates] == department) & (department >= 0))
+    if weights['year_weight']:
+        gap = np.abs(years[candidates] - year)
+        blended += weights['year_weight'] * np.clip(1 - gap / YEAR_SPAN, 0, 1)
+    return blended
+
+
+def score(conn, index, row, weights, candidates=None):
+    # Only students with a positive interest score are eligible; the other
+    # signals reorder them but never add anyone. candidates, when given, must
+    # be in ascending row order (see score_candidates).
+    if candidates is None:
+        scores = score_row(index, row)
+        candidates = np.arange(len(index))
+    else:
+        matrix = index.tfidf_matrix()
+        with timer('similarity_scoring'):
+            scores = (matrix[candidates] @ matrix[row].T).toarray().ravel()
+    keep = (scores > 0) & (candidates != row)
+    candidates, scores = candidates[keep], scores[keep]
+    arrays = profile_arrays(conn, index) if uses_profiles(weights) else ()
+    return candidates, blend(scores, candidates, row, weights, *arrays)
+
+
+def rank(conn, index, row, k, weights, candidates=None):
+    candidates, scores = score(conn, index, row, weights, candidates)
+    with timer('top_k'):
+        best = top_k(scores, k)
+    return candidates[best], scores[best]
+
+
+def rank_query(conn, index, interests, department, year, k, weights, exclude=None):
+    # rank for a student described by their profile rather than a row of
+    # index, such as one held in another shard; exclude is a row to skip.
+    scores = score_query(index, index.query_vector(interests))
+    keep = scores > 0
+    if exclude is not None:
+        keep[exclude] = False
+    candidates = np.flatnonzero(keep)
+    scores = scores[candidates]
+    if uses_profiles(weights):
+        departments, years = profile_arrays(conn, index)
+        code = get_roster(conn).department_code(department)
+        scores = blend_profile(scores, candidates, code, year, weights, departments, years)
+    else:
+        scores = blend_profile(scores, candidates, None, None, weights)
+    with timer('top_k'):
+        best = top_k(scores, k)
+    return candidates[best], scores[best]
+
+
+def rank_rows(matrix, transposed, rows, k, weights, profiles=()):
+    # Ranks many rows from one sparse product; per row only its nonzero
+    # scores are touched. rows are positions in matrix, transposed is
+    # matrix.T in CSR form.
+    scores = (matrix[rows] @ transposed).tocsr()
+    scores.sort_indices()
+    results = []
+    for offset, row in enumerate(rows):
+        begin, end = scores.indptr[offset], scores.indptr[offset + 1]
+        columns = scores.indices[begin:end]
+        values = scores.data[begin:end]
+        keep = (values > 0) & (columns != row)
+        columns, values = columns[keep], values[keep]
+        values = blend(values, columns, row, weights, *profiles)
+        best = top_k(values, k)
+        results.append((row, columns[best], values[best]))
+    return results
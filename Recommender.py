@@ -0,0 +1,499 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from scipy import sparse
+
+from Metrics import increment, timer
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the in-process lock applies.
+    fcntl = None
+
+INDEX_PATH = 'students.index'
+INDEX_FORMAT = 2
+INDEX_VERSIONS_KEPT = 3
+# 'stream' builds the index chunk by chunk straight into the store
+# (Streaming.py) and scores it block by block, instead of in memory.
+FEATURIZATION = os.environ.get('FEATURIZATION', 'memory')
+
+_analyzer = None
+_lock = threading.RLock()
+# Orders this process's stream-mode writes, which don't take _lock.
+_writes = threading.Lock()
+# Index path -> (index, version) for every database this process has used.
+_indexes = {}
+# This thread's last write: (path, version it was applied to, version it
+# published), for the roster hook that follows it.
+_published = threading.local()
+
+
+def _analyze(text):
+    # Built on first use so that loading a saved index doesn't import
+    # scikit-learn.
+    global _analyzer
+    if _analyzer is None:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        _analyzer = TfidfVectorizer().build_analyzer()
+    return _analyzer(text)
+
+
+class InterestIndex:
+    # Raw term counts and document frequencies are kept instead of a fitted
+    # vectorizer so rows can be added, replaced and removed without a refit.
+    # The idf weights and the l2-normalised matrix are derived on demand and
+    # match what TfidfVectorizer().fit_transform would produce for the roster.
+    def __init__(self, ids=None, vocabulary=None, counts=None, df=None):
+        self.ids = list(ids) if ids is not None else []
+        self.vocabulary = vocabulary if vocabulary is not None else {}
+        self.counts = counts if counts is not None else sparse.csr_matrix((0, 0), dtype=np.float64)
+        self.df = df if df is not None else np.zeros(0, dtype=np.int64)
+        self._rows = {student_id: i for i, student_id in enumerate(self.ids)}
+        self._tfidf = None
+        self._postings = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, student_id):
+        return self._rows.get(student_id)
+
+    def _vectorize(self, interests):
+        terms = {}
+        for token in _analyze(interests.lower()):
+            column = self.vocabulary.get(token)
+            if column is None:
+                column = len(self.vocabulary)
+                self.vocabulary[token] = column
+            terms[column] = terms.get(column, 0) + 1
+        columns = np.fromiter(terms.keys(), dtype=np.int32, count=len(terms))
+        values = np.fromiter(terms.values(), dtype=np.float64, count=len(terms))
+        return columns, values
+
+    def _grow(self):
+        size = len(self.vocabulary)
+        if size > len(self.df):
+            self.df = np.concatenate([self.df, np.zeros(size - len(self.df), dtype=np.int64)])
+        if size > self.counts.shape[1]:
+            counts = self.counts
+            self.counts = sparse.csr_matrix((counts.data, counts.indices, counts.indptr),
+                                            shape=(counts.shape[0], size))
+
+    def _row_matrix(self, columns, values):
+        order = np.argsort(columns)
+        return sparse.csr_matrix((values[order], columns[order], [0, len(columns)]),
+                                 shape=(1, len(self.vocabulary)))
+
+    def add(self, student_id, interests):
+        if student_id in self._rows:
+            return self.update(student_id, interests)
+        columns, values = self._vectorize(interests)
+        self._grow()
+        self.df[columns] += 1
+        self.counts = sparse.vstack([self.counts, self._row_matrix(columns, values)], format='csr')
+        self._rows[student_id] = len(self.ids)
+        self.ids.append(student_id)
+        self._tfidf = None
+        self._postings = None
+
+    def extend(self, rows):
+        # Appends many (id, interests) rows with a single stack of the
+        # count matrix; ids already present are updated in place instead.
+        ids, data, indices, indptr = [], [], [], [0]
+        for student_id, interests in rows:
+            if student_id in self._rows:
+                self.update(student_id, interests)
+                continue
+            columns, values = self._vectorize(interests)
+            ids.append(student_id)
+            indices.append(columns)
+            data.append(values)
+            indptr.append(indptr[-1] + len(columns))
+        if not ids:
+            return
+        self._grow()
+        indices = np.concatenate(indices)
+        block = sparse.csr_matrix((np.concatenate(data), indices, indptr), shape=(len(ids), len(self.vocabulary)))
+        block.sort_indices()
+        self.df += np.bincount(indices, minlength=len(self.vocabulary))
+        self.counts = sparse.vstack([self.counts, block], format='csr')
+        self._rows.update((student_id, len(self.ids) + i) for i, student_id in enumerate(ids))
+        self.ids.extend(ids)
+        self._tfidf = None
+        self._postings = None
+
+    def update(self, student_id, interests):
+        row = self._rows.get(student_id)
+        if row is None:
+            return self.add(student_id, interests)
+        self.df[self.counts[row].indices] -= 1
+        columns, values = self._vectorize(interests)
+        self._grow()
+        self.df[columns] += 1
+        self.counts = sparse.vstack([self.counts[:row], self._row_matrix(columns, values),
+                                     self.counts[row + 1:]], format='csr')
+        self._tfidf = None
+        self._postings = None
+
+    def remove(self, student_id):
+        row = self._rows.pop(student_id, None)
+        if row is None:
+            return
+        self.df[self.counts[row].indices] -= 1
+        self.counts = sparse.vstack([self.counts[:row], self.counts[row + 1:]], format='csr')
+        del self.ids[row]
+        for i in range(row, len(self.ids)):
+            self._rows[self.ids[i]] = i
+        self._tfidf = None
+        self._postings = None
+
+    def copy(self):
+        return InterestIndex(self.ids, dict(self.vocabulary), self.counts, self.df.copy())
+
+    def idf(self):
+        n = len(self.ids)
+        return np.log((1 + n) / (1 + self.df)) + 1
+
+    def tfidf_matrix(self):
+        if self._tfidf is None:
+            with timer('tfidf_weighting'):
+                weighted = self.counts.multiply(self.idf()).tocsr()
+                if weighted.shape[0] and weighted.shape[1]:
+                    # normalize rejects an empty matrix: no rows once every
+                    # student is deleted, no columns when no interests hold
+                    # a term.
+                    from sklearn.preprocessing import normalize
+                    weighted = normalize(weighted, norm='l2', copy=False)
+                self._tfidf = weighted
+        return self._tfidf
+
+    def query_vector(self, interests):
+        # interests weighted as a row of this index would be; terms the
+        # index has never seen are dropped. Used to score students held in
+        # another index (another shard) against this one.
+        terms = {}
+        for token in _analyze(interests.lower()):
+            column = self.vocabulary.get(token)
+            if column is not None:
+                terms[column] = terms.get(column, 0) + 1
+        columns = np.array(sorted(terms), dtype=np.int32)
+        values = np.array([terms[column] for column in columns], dtype=np.float64) * self.idf()[columns]
+        norm = np.linalg.norm(values)
+        if norm:
+            values /= norm
+        return sparse.csr_matrix((values, columns, [0, len(columns)]), shape=(1, len(self.vocabulary)))
+
+    def postings(self):
+        # Column-major copy of the tf-idf matrix: each column lists the rows
+        # that contain a term, so scoring one query touches only those rows.
+        if self._postings is None:
+            self._postings = self.tfidf_matrix().tocsc()
+        return self._postings
+
+
+def score_row(index, row):
+    return score_query(index, index.tfidf_matrix()[row])
+
+
+def score_query(index, query):
+    if query.nnz == 0:
+        return np.zeros(len(index))
+    postings = index.postings()
+    with timer('similarity_scoring'):
+        return postings[:, query.indices] @ query.data
+
+
+def top_k(scores, k):
+    # Indices of the k largest scores, highest first and ties broken by
+    # position, which is the order a stable sort over every score gives.
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < len(scores):
+        threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def top_matches(index, row, k):
+    scores = score_row(index, row)
+    scores[row] = 0
+    with timer('top_k'):
+        candidates = np.flatnonzero(scores > 0)
+        best = candidates[top_k(scores[candidates], k)]
+    return best, scores[best]
+
+
+def score_candidates(index, row, candidates, k):
+    # Exact cosine over a subset of rows; candidates must be in ascending row
+    # order so ties resolve the same way as top_matches over the full roster.
+    matrix = index.tfidf_matrix()
+    with timer('similarity_scoring'):
+        scores = (matrix[candidates] @ matrix[row].T).toarray().ravel()
+    with timer('top_k'):
+        keep = (scores > 0) & (candidates != row)
+        candidates, scores = candidates[keep], scores[keep]
+        best = top_k(scores, k)
+    return candidates[best], scores[best]
+
+
+def build_index(conn):
+    with timer('index_build'):
+        index = InterestIndex()
+        index.extend(conn.execute('SELECT id, interests FROM students ORDER BY id'))
+    return index
+
+
+def _csr_arrays(prefix, matrix):
+    return {f'{prefix}_data': matrix.data, f'{prefix}_indices': matrix.indices, f'{prefix}_indptr': matrix.indptr}
+
+
+def index_version(path=INDEX_PATH):
+    try:
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _prune(path, keep):
+    # Older versions stay readable a little longer for processes that have
+    # only just read CURRENT; on POSIX, pages already mapped survive unlinking.
+    versions = sorted(name for name in os.listdir(path) if name.startswith('v'))
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def new_version(path):
+    # A fresh, not yet published version directory under path.
+    if os.path.isfile(path):
+        os.remove(path)
+    version = f'v{time.time_ns():020d}-{os.getpid()}'
+    directory = os.path.join(path, version)
+    os.makedirs(directory)
+    return version, directory
+
+
+def write_meta(directory, shape, terms):
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'format': INDEX_FORMAT, 'shape': list(shape), 'vocabulary': terms}, f)
+
+
+def publish(path, version):
+    tmp_path = os.path.join(path, f'CURRENT.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(path, 'CURRENT'))
+    _prune(path, INDEX_VERSIONS_KEPT)
+
+
+def save_index(index, path=INDEX_PATH):
+    # Each save is a new directory of .npy arrays, published by atomically
+    # replacing CURRENT. Readers never see a half-written version, and
+    # workers map the same files rather than each holding a copy.
+    with timer('index_save'):
+        version, directory = new_version(path)
+        arrays = {'ids': np.asarray(index.ids, dtype=np.int64), 'df': index.df}
+        arrays.update(_csr_arrays('counts', index.counts))
+        arrays.update(_csr_arrays('tfidf', index.tfidf_matrix()))
+        arrays.update(_csr_arrays('postings', index.postings()))
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), array)
+        write_meta(directory, index.counts.shape, sorted(index.vocabulary, key=index.vocabulary.get))
+        publish(path, version)
+    return version
+
+
+def load_index(path=INDEX_PATH, version=None):
+    # The published version unless a (not yet pruned) one is named.
+    version = version or index_version(path)
+    if version is None:
+        return None
+    directory = os.path.join(path, version)
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT:
+            return None
+        arrays = {name[:-4]: np.load(os.path.join(directory, name), mmap_mode='r')
+                  for name in os.listdir(directory) if name.endswith('.npy')}
+    except (OSError, ValueError):
+        return None
+
+    def matrix(prefix, kind=sparse.csr_matrix):
+        return kind((arrays[f'{prefix}_data'], arrays[f'{prefix}_indices'], arrays[f'{prefix}_indptr']),
+                    shape=tuple(meta['shape']), copy=False)
+
+    vocabulary = {term: column for column, term in enumerate(meta['vocabulary'])}
+    index = InterestIndex(arrays['ids'].tolist(), vocabulary, matrix('counts'), np.array(arrays['df']))
+    index._tfidf = matrix('tfidf')
+    index._postings = matrix('postings', sparse.csc_matrix)
+    return index
+
+
+def _current_index(path):
+    version = index_version(path)
+    index, loaded = _indexes.get(path, (None, None))
+    if index is None or version != loaded:
+        index = load_index(path) if version is not None else None
+        _indexes[path] = index, version
+    return index
+
+
+@contextmanager
+def _store_lock(path):
+    # Serialises read-modify-publish of a store between processes; within a
+    # process _lock (or _writes) is held around it, so each takes the file
+    # lock once.
+    if fcntl is None:
+        yield
+        return
+    if os.path.isfile(path):
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'LOCK'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def discard_index(path=INDEX_PATH):
+    # Unpublishes the store, so the next get_index rebuilds it from the
+    # table and rosters stamped with its version are rebuilt too.
+    with _lock, _store_lock(path):
+        try:
+            os.remove(os.path.join(path, 'CURRENT'))
+        except FileNotFoundError:
+            pass
+        _indexes.pop(path, None)
+
+
+@contextmanager
+def index_hooks(path=INDEX_PATH):
+    # Around the index and roster hooks that follow a committed write. If
+    # they fail, the write still stands and reports success; the index is
+    # discarded instead, to be rebuilt from the table on next use.
+    try:
+        yield
+    except Exception:
+        increment('index_hook_errors')
+        try:
+            discard_index(path)
+        except OSError:
+            pass
+
+
+def _check_index(conn, index, path):
+    # Rows written by something that bypassed the hooks below (an older
+    # process, a manual edit) leave the index out of step; rebuild then.
+    if FEATURIZATION == 'stream':
+        # Rebuilt from the table chunk by chunk, so no step holds the whole
+        # count or tf-idf matrix in memory.
+        from Streaming import build_store
+        version = build_store(conn, path)
+        index = load_index(path)
+    else:
+        count = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        if index is None or len(index) != count:
+            index = build_index(conn)
+        version = save_index(index, path)
+    _indexes[path] = index, version
+    return index
+
+
+def _in_step(conn, index):
+    return index is not None and len(index) == conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+
+
+def get_index(conn, path=INDEX_PATH):
+    with _lock:
+        index = _current_index(path)
+        if _in_step(conn, index):
+            return index
+        with _store_lock(path):
+            # Another process may have rebuilt it while this one waited.
+            index = _current_index(path)
+            if _in_step(conn, index):
+                return index
+            return _check_index(conn, index, path)
+
+
+def _apply(conn, rows, removed, path):
+    # Drops the ids in removed, then upserts (id, interests) rows.
+    if FEATURIZATION == 'stream':
+        return _apply_stream(conn, rows, removed, path)
+    with _lock, _store_lock(path):
+        # CURRENT is read again under the file lock, so a change is applied
+        # on top of whatever another process published last. Readers may
+        # still be scoring against the current index outside the lock, so
+        # changes go to a copy that replaces it once complete.
+        index = _current_index(path)
+        base = _indexes[path][1]
+        if index is not None:
+            with timer('index_update'):
+                index = index.copy()
+                for student_id in removed:
+                    index.remove(student_id)
+                index.extend(rows)
+        if _check_index(conn, index, path) is not index:
+            # Rebuilt from the table, so it may hold more than this change.
+            base = None
+        _published.last = path, base, _indexes[path][1]
+
+
+def _apply_stream(conn, rows, removed, path):
+    # The published store is patched into a new version without holding
+    # _lock, so readers go on scoring the current one meanwhile. Only a
+    # store that is missing or out of step is rebuilt from the table.
+    from Streaming import build_store, patch_store
+    with _writes, _store_lock(path):
+        base = index_version(path)
+        index, loaded = _indexes.get(path, (None, None))
+        if base is not None and loaded != base:
+            index = load_index(path, base)
+        count = None
+        if base is not None and index is not None:
+            version, count = patch_store(path, index, rows, removed)
+        if count != conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]:
+            base, version = None, build_store(conn, path)
+    _published.last = path, base, version
+
+
+def last_published(path=INDEX_PATH):
+    # (version applied to, version published) for this thread's last write
+    # to path, or None; the first is None when the write rebuilt the index.
+    last = getattr(_published, 'last', None)
+    if last is None or last[0] != path:
+        return None
+    return last[1:]
+
+
+def index_add_student(conn, student_id, interests, path=INDEX_PATH):
+    _apply(conn, [(student_id, interests)], (), path)
+
+
+def index_add_students(conn, rows, path=INDEX_PATH):
+    _apply(conn, list(rows), (), path)
+
+
+def index_replace_students(conn, rows, removed, path=INDEX_PATH):
+    # One refresh for a batch of removals and (id, interests) upserts.
+    _apply(conn, list(rows), removed, path)
+
+
+def index_update_student(conn, student_id, interests, path=INDEX_PATH):
+    _apply(conn, [(student_id, interests)], (), path)
+
+
+def index_delete_student(conn, student_id, path=INDEX_PATH):
+    _apply(conn, [], [student_id], path)
@@ -0,0 +1,170 @@
+import sys
+import threading
+
+import numpy as np
+
+import Connection
+from Metrics import timer
+from Recommender import index_version, last_published
+
+COLUMNS = 'id, name, department, year, email, user_id'
+
+_lock = threading.Lock()
+# Database path -> its roster.
+_rosters = {}
+
+
+def _column(values, ids, missing):
+    # Ids newer than the roster (written by another thread a moment ago)
+    # read as missing instead of failing.
+    out = np.full(len(ids), missing, dtype=values.dtype)
+    inside = ids < len(values)
+    out[inside] = values[ids[inside]]
+    return out
+
+
+class Roster:
+    # Columns are positioned by student id, which AUTOINCREMENT keeps dense,
+    # so a lookup is an index rather than a search. Departments are stored
+    # once each, upper-cased, and referenced by code; deleted ids keep code
+    # -1. Arrays are replaced rather than resized when they grow, so readers
+    # holding the old ones are unaffected.
+    def __init__(self, capacity=0):
+        self.departments = np.full(capacity, -1, dtype=np.int32)
+        self.years = np.zeros(capacity, dtype=np.int8)
+        self.names = [None] * capacity
+        self.emails = [None] * capacity
+        self.user_ids = [None] * capacity
+        self.department_names = []
+        self._department_codes = {}
+        self._ids = {}
+        self.stamp = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _grow(self, student_id):
+        size = len(self.names)
+        if student_id < size:
+            return
+        size = max(student_id + 1, 2 * size)
+        departments = np.full(size, -1, dtype=np.int32)
+        departments[:len(self.departments)] = self.departments
+        years = np.zeros(size, dtype=np.int8)
+        years[:len(self.years)] = self.years
+        self.departments, self.years = departments, years
+        for column in (self.names, self.emails, self.user_ids):
+            column.extend([None] * (size - len(column)))
+
+    def _department_code(self, department):
+        department = department.strip().upper()
+        code = self._department_codes.get(department)
+        if code is None:
+            code = self._department_codes[department] = len(self.department_names)
+            self.department_names.append(sys.intern(department))
+        return code
+
+    def department_code(self, department):
+        # -1, which matches nobody, for a department no student here is in.
+        return self._department_codes.get(department.strip().upper(), -1)
+
+    def set(self, student_id, name, department, year, email, user_id):
+        self._grow(student_id)
+        previous = self.user_ids[student_id]
+        if previous is not None and previous != user_id:
+            self._ids.pop(previous, None)
+        self.departments[student_id] = self._department_code(department)
+        self.years[student_id] = year
+        self.names[student_id] = name
+        self.emails[student_id] = email
+        self.user_ids[student_id] = user_id
+        self._ids[user_id] = student_id
+
+    def remove(self, student_id):
+        if student_id >= len(self.names) or self.user_ids[student_id] is None:
+            return
+        self._ids.pop(self.user_ids[student_id], None)
+        self.departments[student_id] = -1
+        self.years[student_id] = 0
+        self.names[student_id] = self.emails[student_id] = self.user_ids[student_id] = None
+
+    def student_id(self, user_id):
+        return self._ids.get(user_id)
+
+    def contacts(self, student_ids):
+        names, emails = self.names, self.emails
+        return [(names[i], emails[i]) for i in student_ids if i < len(names) and names[i] is not None]
+
+    def profiles(self, ids):
+        return _column(self.departments, ids, -1), _column(self.years, ids, 0)
+
+
+def build_roster(conn):
+    with timer('roster_build'):
+        size = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM students').fetchone()[0]
+        roster = Roster(size)
+        for row in conn.execute(f'SELECT {COLUMNS} FROM students'):
+            roster.set(*row)
+    return roster
+
+
+def _stamp():
+    # Every write goes through the recommender index hooks, which publish a
+    # new index version, so a different version means some process has written.
+    return index_version(Connection.index_path())
+
+
+def get_roster(conn):
+    with _lock:
+        path, stamp = Connection.current_path(), _stamp()
+        roster = _rosters.get(path)
+        if roster is None or roster.stamp != stamp:
+            roster = _rosters[path] = build_roster(conn)
+            roster.stamp = stamp
+        return roster
+
+
+def _apply(change):
+    # Runs after the index hook. The change only brings the roster up to the
+    # version that hook published if the roster was built at the version it
+    # was applied to; otherwise writes from elsewhere are missing, so it is
+    # dropped and rebuilt on next use, as is a roster not built yet.
+    with _lock:
+        path = Connection.current_path()
+        roster = _rosters.get(path)
+        if roster is None:
+            return
+        versions = last_published(Connection.index_path())
+        if versions is None or versions[0] is None or roster.stamp != versions[0]:
+            del _rosters[path]
+            return
+        change(roster)
+        roster.stamp = versions[1]
+
+
+def roster_set_student(student_id, name, department, year, email, user_id):
+    _apply(lambda roster: roster.set(student_id, name, department, year, email, user_id))
+
+
+def roster_add_students(rows):
+    rows = list(rows)
+
+    def add(roster):
+        for row in rows:
+            roster.set(*row)
+    _apply(add)
+
+
+def roster_replace_students(rows, removed):
+    rows = list(rows)
+
+    def change(roster):
+        for student_id in removed:
+            roster.remove(student_id)
+        for row in rows:
+            roster.set(*row)
+    _apply(change)
+
+
+def roster_delete_student(student_id):
+    _apply(lambda roster: roster.remove(student_id))
@@ -0,0 +1,78 @@
+import re
+
+_words = re.compile(r'\w+')
+# The same tokens TfidfVectorizer keeps: two or more word characters.
+_terms = re.compile(r'\w\w+')
+
+
+def create_search_table(conn):
+    # An external-content FTS5 index over the students table: the text is
+    # stored once, in students, and the triggers keep the index in step with
+    # every insert, update and delete, whichever code path makes them.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5(
+            name, department, interests,
+            content='students', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_search_insert AFTER INSERT ON students BEGIN
+            INSERT INTO student_search (rowid, name, department, interests)
+            VALUES (new.id, new.name, new.department, new.interests);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_search_delete AFTER DELETE ON students BEGIN
+            INSERT INTO student_search (student_search, rowid, name, department, interests)
+            VALUES ('delete', old.id, old.name, old.department, old.interests);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS students_search_update AFTER UPDATE OF name, department, interests ON students BEGIN
+            INSERT INTO student_search (student_search, rowid, name, department, interests)
+            VALUES ('delete', old.id, old.name, old.department, old.interests);
+            INSERT INTO student_search (rowid, name, department, interests)
+            VALUES (new.id, new.name, new.department, new.interests);
+        END
+    ''')
+
+
+def rebuild_search(conn):
+    # For databases that had students before the index existed.
+    conn.execute("INSERT INTO student_search (student_search) VALUES ('rebuild')")
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_query(text):
+    # "mach learn" -> '"mach"* "learn"*': every word, as a prefix, anywhere
+    # in name, department or interests. None when there is nothing to match.
+    words = _words.findall(text.lower())
+    return ' '.join(_quote(word) + '*' for word in words) or None
+
+
+def interest_query(interests):
+    # Any of the student's interest terms, in the interests column only;
+    # bm25 then favours rarer terms and students sharing more of them.
+    terms = list(dict.fromkeys(_terms.findall(interests.lower())))
+    if not terms:
+        return None
+    return 'interests : (' + ' OR '.join(_quote(term) for term in terms) + ')'
+
+
+def bm25_candidates(conn, student_id, limit):
+    # Ids of the `limit` students whose interests best match this student's
+    # by bm25, found through the FTS5 index in one query.
+    row = conn.execute('SELECT interests FROM students WHERE id = ?', (student_id,)).fetchone()
+    query = interest_query(row[0]) if row else None
+    if query is None:
+        return []
+    c = conn.execute('''
+        SELECT rowid FROM student_search
+        WHERE student_search MATCH ? AND rowid != ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (query, student_id, limit))
+    return [match_id for match_id, in c]
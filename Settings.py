@@ -0,0 +1,66 @@
+from Cache import cached, invalidate
+from ChangeLog import clear_changes
+from Connection import connection
+
+# Admin-tunable values, stored as text and converted back to the type of
+# their default when read.
+DEFAULTS = {
+    'match_count': 2,
+    'interest_weight': 1.0,
+    'department_weight': 0.0,
+    'year_weight': 0.0,
+}
+
+
+def create_settings_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+@cached('settings')
+def get_settings():
+    with connection() as conn:
+        stored = dict(conn.execute('SELECT key, value FROM settings').fetchall())
+    return {key: type(default)(stored.get(key, default)) for key, default in DEFAULTS.items()}
+
+
+def save_settings(values):
+    unknown = set(values) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    weights_changed = any(get_settings()[key] != type(DEFAULTS[key])(value)
+                          for key, value in values.items() if key.endswith('_weight'))
+    with connection() as conn, conn:
+        conn.executemany('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', [(key, str(value)) for key, value in values.items()])
+        # Precomputed lists were ranked under the old weights; Batch.py has
+        # to run again before they are served.
+        if weights_changed:
+            conn.execute('DELETE FROM student_matches')
+            clear_changes(conn)
+            record_batch_depth(conn, None)
+    invalidate('settings', 'matches')
+
+
+def record_batch_depth(conn, depth):
+    # How many matches Batch.py stored per student, kept with the settings
+    # but not one of them; a student with fewer ran out of matches. None
+    # once the stored lists are gone.
+    if depth is None:
+        conn.execute("DELETE FROM settings WHERE key = 'batch_depth'")
+    else:
+        conn.execute('''
+            INSERT INTO settings (key, value) VALUES ('batch_depth', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', (str(depth),))
+
+
+def batch_depth(conn):
+    row = conn.execute("SELECT value FROM settings WHERE key = 'batch_depth'").fetchone()
+    return int(row[0]) if row else None
@@ -0,0 +1,228 @@
+import heapq
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import Database
+from Cache import cache_for, cached, invalidate
+from Connection import connection, index_path, using
+from Credentials import reject_unknown
+from Settings import get_settings
+
+# Students live in one database file per shard under SHARD_DIR, chosen by
+# SHARD_KEY ('campus' or 'department'); _directory.db maps every user_id (and
+# email, which stays unique across shards) to its shard. Every Database
+# function works on a shard unchanged inside using(shard_path(shard)).
+SHARD_DIR = os.environ.get('SHARD_DIR', 'shards')
+SHARD_KEY = os.environ.get('SHARD_KEY', 'campus')
+# 'local' matches students within their own shard, 'all' across every shard.
+MATCH_SCOPE = os.environ.get('MATCH_SCOPE', 'local')
+WORKERS = int(os.environ.get('SHARD_WORKERS', '8'))
+
+_slug = re.compile(r'[^a-z0-9]+')
+_lock = threading.Lock()
+_opened = set()
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='shard')
+
+
+def directory_path():
+    # Shard names never start with '_', so this can't clash with a shard.
+    return os.path.join(SHARD_DIR, '_directory.db')
+
+
+def shard_path(shard):
+    return os.path.join(SHARD_DIR, f'{shard}.db')
+
+
+def shard_name(department=None, campus=None):
+    value = campus if SHARD_KEY == 'campus' else department
+    if not value or not value.strip():
+        raise ValueError(f"a {SHARD_KEY} is needed to place a student in a shard")
+    return _slug.sub('_', value.strip().lower()).strip('_') or 'default'
+
+
+def open_directory():
+    with _lock:
+        if '_directory' in _opened:
+            return
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        with using(directory_path()), connection() as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS directory (
+                    user_id TEXT PRIMARY KEY,
+                    email TEXT UNIQUE NOT NULL,
+                    shard TEXT NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY) WITHOUT ROWID')
+        _opened.add('_directory')
+
+
+def _open_shard(shard):
+    with _lock:
+        if shard in _opened:
+            return
+        with using(shard_path(shard)):
+            Database.create_table()
+        _opened.add(shard)
+
+
+@cached('directory')
+def shards():
+    open_directory()
+    with using(directory_path()), connection() as conn:
+        return [name for name, in conn.execute('SELECT name FROM shards ORDER BY name')]
+
+
+def shard_of(user_id):
+    # Only hits are cached, so a user_id registered by another process is
+    # found straight away rather than after the cache's ttl.
+    cache = cache_for('directory')
+    key = ('shard_of', user_id)
+    generation = cache.generation
+    found, shard = cache.get(key)
+    if found:
+        return shard
+    open_directory()
+    with using(directory_path()), connection() as conn:
+        row = conn.execute('SELECT shard FROM directory WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    cache.set(key, row[0], generation)
+    return row[0]
+
+
+def add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password, campus=None):
+    # The user_id and email are claimed in the directory first, so two shards
+    # can never both accept them; the claim is dropped if the shard refuses.
+    shard = shard_name(department, campus)
+    open_directory()
+    _open_shard(shard)
+    with using(directory_path()), connection() as conn:
+        try:
+            with conn:
+                conn.execute('INSERT INTO directory (user_id, email, shard) VALUES (?, ?, ?)', (user_id, email, shard))
+                conn.execute('INSERT OR IGNORE INTO shards (name) VALUES (?)', (shard,))
+        except sqlite3.IntegrityError:
+            return False
+    with using(shard_path(shard)):
+        added = Database.add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id, password)
+    if not added:
+        with using(directory_path()), connection() as conn, conn:
+            conn.execute('DELETE FROM directory WHERE user_id = ? AND shard = ?', (user_id, shard))
+    invalidate('directory')
+    return added
+
+
+def _student_id(user_id):
+    with connection() as conn:
+        row = conn.execute('SELECT id FROM students WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def update_student(user_id, name, department, year, interests, linkedin_id, phone_number, password='',
+                   email=None, new_user_id=None):
+    # As Database.update_student, for the student with user_id. A new
+    # user_id or email is claimed in the directory first and handed back if
+    # the shard refuses the update. The student stays in their shard even if
+    # the department it was chosen by changes.
+    shard = shard_of(user_id)
+    if shard is None:
+        return False
+    with using(directory_path()), connection() as conn:
+        previous = conn.execute('SELECT email FROM directory WHERE user_id = ?', (user_id,)).fetchone()
+        if previous is None:
+            return False
+        claimed = (new_user_id or user_id, email or previous[0])
+        try:
+            with conn:
+                conn.execute('UPDATE directory SET user_id = ?, email = ? WHERE user_id = ?', (*claimed, user_id))
+        except sqlite3.IntegrityError:
+            return False
+    with using(shard_path(shard)):
+        student_id = _student_id(user_id)
+        updated = student_id is not None and Database.update_student(
+            student_id, name, department, year, interests, linkedin_id, phone_number, password, email, new_user_id)
+    if not updated:
+        with using(directory_path()), connection() as conn, conn:
+            conn.execute('UPDATE directory SET user_id = ?, email = ? WHERE user_id = ?', (user_id, previous[0], claimed[0]))
+    invalidate('directory')
+    return updated
+
+
+def delete_student(user_id):
+    # The directory entry goes once the shard has deleted the student, which
+    # frees the user_id and email for a new registration on any shard.
+    shard = shard_of(user_id)
+    if shard is None:
+        return False
+    with using(shard_path(shard)):
+        student_id = _student_id(user_id)
+        deleted = student_id is not None and Database.delete_student(student_id)
+    if deleted:
+        with using(directory_path()), connection() as conn, conn:
+            conn.execute('DELETE FROM directory WHERE user_id = ?', (user_id,))
+        invalidate('directory')
+    return deleted
+
+
+def verify_user(user_id, password):
+    shard = shard_of(user_id)
+    if shard is None:
+        return reject_unknown(password)
+    with using(shard_path(shard)):
+        return Database.verify_user(user_id, password)
+
+
+def student_exists(user_id):
+    return shard_of(user_id) is not None
+
+
+def _shard_matches(shard, order, profile, depth, weights):
+    # The best `depth` students of one shard for a profile, as merge keys.
+    from Ranking import rank_query
+    from Recommender import get_index
+    from Roster import get_roster
+    student_id, department, year, interests, home = profile
+    with using(shard_path(shard)), connection() as conn:
+        index = get_index(conn, index_path())
+        roster = get_roster(conn)
+        exclude = index.row_of(student_id) if shard == home else None
+        rows, scores = rank_query(conn, index, interests, department, year, depth, weights, exclude)
+        return [(-float(score), order, position, contact)
+                for position, (row, score) in enumerate(zip(rows, scores))
+                for contact in roster.contacts([index.ids[row]])]
+
+
+@cached('matches')
+def federated_matches(user_id, depth=Database.RANKED_DEPTH):
+    # Every shard ranks the student's profile against its own index in
+    # parallel; the per-shard lists, each best first, are merged into one.
+    # Scores use each shard's own term weights, as a search over several
+    # indexes does.
+    home = shard_of(user_id)
+    if home is None:
+        return []
+    with using(shard_path(home)), connection() as conn:
+        row = conn.execute('SELECT id, department, year, interests FROM students WHERE user_id = ?', (user_id,)).fetchone()
+        weights = get_settings()
+    if row is None:
+        return []
+    profile = (*row, home)
+    futures = [_executor.submit(_shard_matches, shard, order, profile, depth, weights)
+               for order, shard in enumerate(shards())]
+    merged = heapq.merge(*(future.result() for future in futures))
+    return [contact for _, _, _, contact in merged][:depth]
+
+
+def find_matches(user_id, k=None, offset=0, scope=None):
+    home = shard_of(user_id)
+    if home is None:
+        return []
+    with using(shard_path(home)):
+        if (scope or MATCH_SCOPE) == 'local':
+            return Database.find_matches(user_id, k, offset)
+        k = k or get_settings()['match_count']
+    return federated_matches(user_id, max(Database.RANKED_DEPTH, offset + k))[offset:offset + k]
@@ -0,0 +1,238 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+
+import Connection
+from Connection import connection, index_path
+from Metrics import timer
+from Ranking import blend, profile_arrays, uses_profiles
+from Recommender import InterestIndex, new_version, publish, top_k, write_meta
+
+# Rows read from SQLite, and rows scored, per step. Memory for building and
+# scoring grows with these and the vocabulary, not with the roster.
+CHUNK_SIZE = int(os.environ.get('FEATURIZATION_CHUNK_SIZE', '10000'))
+BLOCK_SIZE = int(os.environ.get('SCORING_BLOCK_SIZE', '50000'))
+
+
+def student_chunks(conn, chunk_size=CHUNK_SIZE):
+    cursor = conn.execute('SELECT id, interests FROM students ORDER BY id')
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _counts_block(terms, width):
+    # Raw count rows, one (columns, values) pair each, as a CSR block.
+    indptr = np.concatenate([[0], np.cumsum([len(columns) for columns, _ in terms], dtype=np.int64)])
+    data = np.concatenate([values for _, values in terms]) if terms else np.zeros(0)
+    indices = np.concatenate([columns for columns, _ in terms]) if terms else np.zeros(0, dtype=np.int32)
+    block = sparse.csr_matrix((data, indices, indptr), shape=(len(terms), width))
+    block.sort_indices()
+    return block
+
+
+def count_chunks(chunks, vectorizer):
+    # Each chunk as (ids, raw term counts); vectorizer assigns columns in
+    # first-seen order, exactly as build_index does.
+    for rows in chunks:
+        ids = [student_id for student_id, _ in rows]
+        terms = [vectorizer._vectorize(interests) for _, interests in rows]
+        yield ids, _counts_block(terms, len(vectorizer.vocabulary))
+
+
+def _array(directory, name, shape, dtype):
+    return open_memmap(os.path.join(directory, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+
+def build_store(conn, path, chunk_size=CHUNK_SIZE):
+    # Two passes over the table: the first fixes the vocabulary, document
+    # frequencies and sizes, the second weights each chunk and writes it
+    # into preallocated .npy files of the store format load_index reads.
+    # The result is identical to build_index followed by save_index.
+    started = not conn.in_transaction
+    if started:
+        # Both passes read the same snapshot.
+        conn.execute('BEGIN')
+    try:
+        with timer('index_build'):
+            vectorizer = InterestIndex()
+            df = np.zeros(0, dtype=np.int64)
+            rows = nnz = 0
+            for ids, block in count_chunks(student_chunks(conn, chunk_size), vectorizer):
+                df = np.concatenate([df, np.zeros(block.shape[1] - len(df), dtype=np.int64)])
+                df += np.bincount(block.indices, minlength=block.shape[1])
+                rows += len(ids)
+                nnz += block.nnz
+            terms = sorted(vectorizer.vocabulary, key=vectorizer.vocabulary.get)
+            chunks = count_chunks(student_chunks(conn, chunk_size), vectorizer)
+            version = _write_store(path, chunks, rows, nnz, df, terms)
+    finally:
+        if started:
+            conn.rollback()
+    return version
+
+
+def _write_store(path, chunks, rows, nnz, df, terms):
+    # Weights chunks of (ids, raw counts), in row order and `rows` and `nnz`
+    # in total, by the document frequencies df, and publishes them as a new
+    # version.
+    from sklearn.preprocessing import normalize
+    width = len(terms)
+    idf = np.log((1 + rows) / (1 + df)) + 1
+    dtype = np.int32 if max(rows, width, nnz) < 2 ** 31 else np.int64
+
+    version, directory = new_version(path)
+    np.save(os.path.join(directory, 'df.npy'), df)
+    arrays = {'ids': _array(directory, 'ids', (rows,), np.int64)}
+    for prefix in ('counts', 'tfidf', 'postings'):
+        arrays[f'{prefix}_data'] = _array(directory, f'{prefix}_data', (nnz,), np.float64)
+        arrays[f'{prefix}_indices'] = _array(directory, f'{prefix}_indices', (nnz,), dtype)
+    for prefix in ('counts', 'tfidf'):
+        arrays[f'{prefix}_indptr'] = _array(directory, f'{prefix}_indptr', (rows + 1,), dtype)
+        arrays[f'{prefix}_indptr'][0] = 0
+    postings_indptr = np.concatenate([[0], np.cumsum(df)])
+    arrays['postings_indptr'] = _array(directory, 'postings_indptr', (width + 1,), dtype)
+    arrays['postings_indptr'][:] = postings_indptr
+    # Next free slot of each term's postings list.
+    cursor = postings_indptr[:-1].copy()
+
+    start = begin = 0
+    for ids, block in chunks:
+        weighted = block.multiply(idf).tocsr()
+        if width:
+            weighted = normalize(weighted, norm='l2', copy=False)
+        stop, end = start + len(ids), begin + block.nnz
+        arrays['ids'][start:stop] = ids
+        for prefix, matrix in (('counts', block), ('tfidf', weighted)):
+            arrays[f'{prefix}_data'][begin:end] = matrix.data
+            arrays[f'{prefix}_indices'][begin:end] = matrix.indices
+            arrays[f'{prefix}_indptr'][start + 1:stop + 1] = matrix.indptr[1:] + begin
+        # Postings are filled column by column in row order, which is the
+        # layout tocsc() gives.
+        order = np.argsort(weighted.indices, kind='stable')
+        columns = weighted.indices[order]
+        positions = cursor[columns] + np.arange(len(columns)) - np.searchsorted(columns, columns)
+        arrays['postings_indices'][positions] = np.repeat(np.arange(start, stop), np.diff(weighted.indptr))[order]
+        arrays['postings_data'][positions] = weighted.data[order]
+        cursor += np.bincount(columns, minlength=width)
+        start, begin = stop, end
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    write_meta(directory, (rows, width), terms)
+    publish(path, version)
+    return version
+
+
+def patch_store(path, index, rows, removed, chunk_size=CHUNK_SIZE):
+    # A new version from the published one, index, with the ids in removed
+    # dropped and then (id, interests) rows upserted: an id still present
+    # keeps its row, others are appended. One pass over the mapped counts
+    # and no reads of the table, so a write costs a fraction of build_store;
+    # the result is what applying the same change in memory and saving the
+    # index gives. Returns the version and its row count.
+    with timer('index_update'):
+        vectorizer = InterestIndex(vocabulary=dict(index.vocabulary))
+        removed = {student_id for student_id in removed if index.row_of(student_id) is not None}
+        replaced, appended = {}, {}
+        for student_id, interests in rows:
+            kept = index.row_of(student_id) is not None and student_id not in removed
+            (replaced if kept else appended)[student_id] = vectorizer._vectorize(interests)
+        width = len(vectorizer.vocabulary)
+        counts = index.counts
+        df = np.concatenate([index.df, np.zeros(width - len(index.df), dtype=np.int64)])
+        nnz = counts.nnz
+        for student_id in removed | replaced.keys():
+            row = index.row_of(student_id)
+            columns = counts.indices[counts.indptr[row]:counts.indptr[row + 1]]
+            df[columns] -= 1
+            nnz -= len(columns)
+        for columns, _ in (*replaced.values(), *appended.values()):
+            df[columns] += 1
+            nnz += len(columns)
+        # Rows of index to drop (None) or replace, in row order.
+        touched = sorted((index.row_of(student_id), replaced.get(student_id))
+                         for student_id in removed | replaced.keys())
+
+        def chunks():
+            position = 0
+            for start in range(0, len(index), chunk_size):
+                stop = min(start + chunk_size, len(index))
+                block = counts[start:stop]
+                block = sparse.csr_matrix((block.data, block.indices, block.indptr), shape=(stop - start, width))
+                ids = index.ids[start:stop]
+                if position < len(touched) and touched[position][0] < stop:
+                    pieces, kept, previous = [], [], start
+                    while position < len(touched) and touched[position][0] < stop:
+                        row, terms = touched[position]
+                        pieces.append(block[previous - start:row - start])
+                        kept.extend(index.ids[previous:row])
+                        if terms is not None:
+                            pieces.append(_counts_block([terms], width))
+                            kept.append(index.ids[row])
+                        previous = row + 1
+                        position += 1
+                    pieces.append(block[previous - start:])
+                    kept.extend(index.ids[previous:stop])
+                    block, ids = sparse.vstack(pieces, format='csr'), kept
+                if ids:
+                    yield ids, block
+            added = list(appended.items())
+            for start in range(0, len(added), chunk_size):
+                part = added[start:start + chunk_size]
+                yield [student_id for student_id, _ in part], _counts_block([terms for _, terms in part], width)
+
+        count = len(index) - len(removed) + len(appended)
+        terms = sorted(vectorizer.vocabulary, key=vectorizer.vocabulary.get)
+        return _write_store(path, chunks(), count, nnz, df, terms), count
+
+
+def stream_rank(conn, index, row, k, weights, block_size=BLOCK_SIZE):
+    # Like Ranking.rank over the whole roster, but the memory-mapped rows are
+    # scored a block at a time and only the best k seen so far are kept, in
+    # a heap keyed so that ties resolve by position as top_k does.
+    matrix = index.tfidf_matrix()
+    query = matrix[row].toarray().ravel()
+    profiles = profile_arrays(conn, index) if uses_profiles(weights) else ()
+    heap = []
+    with timer('similarity_scoring'):
+        for start in range(0, matrix.shape[0], block_size):
+            scores = matrix[start:start + block_size] @ query
+            candidates = np.flatnonzero(scores > 0)
+            scores = scores[candidates]
+            candidates += start
+            keep = candidates != row
+            candidates = candidates[keep]
+            scores = blend(scores[keep], candidates, row, weights, *profiles)
+            for i in top_k(scores, k):
+                item = (scores[i], -candidates[i])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+    best = sorted(heap, reverse=True)
+    return np.array([-position for _, position in best], dtype=np.intp), np.array([score for score, _ in best])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the recommender index out of core, chunk by chunk.")
+    parser.add_argument('--db', default=Connection.DB_PATH, help="path to the students database")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows read and written per chunk")
+    args = parser.parse_args()
+    Connection.configure(args.db)
+
+    started = time.perf_counter()
+    with connection() as conn:
+        version = build_store(conn, index_path(), args.chunk_size)
+    print(f"Published {version} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 import streamlit as st
-from Database import add_student, verify_user, find_matches
+from Metrics import timed
+from concurrent.futures import TimeoutError
+from Engine import add_student, asks_campus, verify_user
+from Settings import get_settings
+from Worker import recommend_async
+
+# Cached matches come back well within this; anything slower is rendered
+# later by the polling fragment so the rest of the page is not held up.
+FAST_PATH_SECONDS = 0.05
 
 def student_login():
     user_id = st.text_input("User ID", key="login_user_id")
@@ -18,6 +26,8 @@ def student_registration():
     with st.form(key='register_form'):
         name = st.text_input("Name")
         department = st.text_input("Department")
+        # Only asked when students are sharded by campus
+        campus = st.text_input("Campus") if asks_campus() else None
         year = st.number_input("Year", min_value=1, max_value=4)
         interests = st.text_input("Interests (comma separated)")
         linkedin_id = st.text_input("LinkedIn ID")
@@ -28,19 +38,54 @@ def student_registration():
 
         submit_button = st.form_submit_button("Register")
         if submit_button:
-            if not (name and department and year and interests and email and user_id_reg and password_reg):
+            if not (name and department and year and interests and email and user_id_reg and password_reg and campus != ""):
                 st.error("All fields are required!")
             else:
-                if add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id_reg, password_reg):
+                if add_student(name, department, year, interests, linkedin_id, phone_number, email, user_id_reg, password_reg, campus):
                     st.success("Student registered successfully! 🎉")
                 else:
                     st.error("Failed to register. User ID or Email might already be in use.")
 
+@timed('render_student_main')
 def student_main():
-    matched_students = find_matches(st.session_state['username'])
     st.subheader("Connected People: ")
+    user_id = st.session_state['username']
+    page_size = get_settings()['match_count']
+    matched_students = []
+    st.session_state.pop('pending_matches', None)
+    for page in range(st.session_state.get('match_pages', 1)):
+        future = recommend_async(user_id, page_size, page * page_size)
+        try:
+            matches = future.result(timeout=FAST_PATH_SECONDS)
+        except TimeoutError:
+            if matched_students:
+                show_matches(matched_students)
+            # The fragment polls this very future: once a job finishes it
+            # leaves the worker's table, so asking recommend_async again
+            # would only submit another one.
+            st.session_state['pending_matches'] = future
+            pending_matches()
+            return
+        matched_students.extend(matches)
+    show_matches(matched_students)
+    # A short page means the ranking has run out
+    if matched_students and len(matches) == page_size:
+        st.button("Show more matches", on_click=load_more)
+
+def load_more():
+    st.session_state['match_pages'] = st.session_state.get('match_pages', 1) + 1
+
+@st.fragment(run_every=0.5)
+def pending_matches():
+    future = st.session_state.get('pending_matches')
+    if future is None or future.done():
+        st.session_state.pop('pending_matches', None)
+        st.rerun()
+    st.info("Finding people who share your interests...")
+
+def show_matches(matched_students):
     if matched_students:
         for student, email in matched_students:
             st.write(f"**{student}** -  Email: {email}")
     else:
-        st.write("No connections found, try after some time🙂")
\ No newline at end of file
+        st.write("No connections found, try after some time🙂")
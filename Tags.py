@@ -0,0 +1,74 @@
+import re
+
+_separators = re.compile(r'[,;\n]+')
+_spaces = re.compile(r'\s+')
+
+
+def parse_interests(text):
+    # "Python, machine  learning;Python" -> ['python', 'machine learning']
+    tags = (_spaces.sub(' ', part).strip().lower() for part in _separators.split(text or ''))
+    return list(dict.fromkeys(tag for tag in tags if tag))
+
+
+def create_tag_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS interests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tag TEXT UNIQUE NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS student_interests (
+            student_id INTEGER NOT NULL,
+            interest_id INTEGER NOT NULL,
+            PRIMARY KEY (student_id, interest_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_student_interests_interest ON student_interests (interest_id, student_id)')
+
+
+def _tag_ids(conn, tags):
+    conn.executemany('INSERT OR IGNORE INTO interests (tag) VALUES (?)', [(tag,) for tag in tags])
+    c = conn.execute(f'SELECT tag, id FROM interests WHERE tag IN ({",".join("?" * len(tags))})', tags)
+    return dict(c.fetchall())
+
+
+def set_student_tags(conn, student_id, interests):
+    set_many_student_tags(conn, [(student_id, interests)])
+
+
+def set_many_student_tags(conn, rows):
+    # Runs inside the caller's transaction so tags always agree with the
+    # students row they were parsed from.
+    parsed = [(student_id, parse_interests(interests)) for student_id, interests in rows]
+    conn.executemany('DELETE FROM student_interests WHERE student_id = ?', [(student_id,) for student_id, _ in parsed])
+    tags = sorted({tag for _, student_tags in parsed for tag in student_tags})
+    if not tags:
+        return
+    ids = {}
+    for start in range(0, len(tags), 500):
+        ids.update(_tag_ids(conn, tags[start:start + 500]))
+    conn.executemany('INSERT OR IGNORE INTO student_interests (student_id, interest_id) VALUES (?, ?)',
+                     [(student_id, ids[tag]) for student_id, student_tags in parsed for tag in student_tags])
+
+
+def delete_student_tags(conn, student_id):
+    conn.execute('DELETE FROM student_interests WHERE student_id = ?', (student_id,))
+
+
+def backfill_tags(conn, batch_size=1000):
+    c = conn.execute('SELECT id, interests FROM students ORDER BY id')
+    while rows := c.fetchmany(batch_size):
+        set_many_student_tags(conn, rows)
+
+
+def tag_candidates(conn, student_id):
+    # Students sharing at least one tag, found through the interest_id index
+    # rather than by scoring the whole roster.
+    c = conn.execute('''
+        SELECT DISTINCT other.student_id
+        FROM student_interests mine
+        JOIN student_interests other ON other.interest_id = mine.interest_id
+        WHERE mine.student_id = ? AND other.student_id != ?
+    ''', (student_id, student_id))
+    return [row[0] for row in c.fetchall()]
@@ -0,0 +1,38 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Engine import recommend
+from Metrics import increment
+from Settings import get_settings
+
+WORKERS = int(os.environ.get('RECOMMENDER_WORKERS', '4'))
+
+# One executor per process, shared by every Streamlit session it serves.
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='recommender')
+_lock = threading.Lock()
+_pending = {}
+
+
+def _finished(key, future):
+    with _lock:
+        if _pending.get(key) is future:
+            del _pending[key]
+
+
+def submit(key, func, *args):
+    # Requests for a key that is already being computed share its future.
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            increment('worker_deduplicated')
+            return future
+        future = _executor.submit(func, *args)
+        _pending[key] = future
+    future.add_done_callback(lambda done: _finished(key, done))
+    return future
+
+
+def recommend_async(user_id, k=None, offset=0):
+    k = k or get_settings()['match_count']
+    return submit(('matches', user_id, k, offset), recommend, user_id, k, offset)